@@ -0,0 +1,142 @@
+""" 
+    Compact binary form of the xml_dict_to_json schema
+
+    A record is a fixed 20 byte header (magic, version, depth, path length,
+    width, height, box count), the utf8 file path padded to 4 bytes, then one
+    packed little endian int32 row per box: class_id, left, top, width, height.
+    Categories are rebuilt from the class ids. A .ann file holds one record,
+    a pack file holds many back to back
+
+    python annotation_binary.py final_train final_train_ann
+    python annotation_binary.py final_train final_train.annpack --pack
+ """
+
+import argparse
+import json
+import os
+import struct
+
+import numpy as np
+
+from dataset_format import CLASS_IDS_MAP
+
+MAGIC = b"RPAN"
+VERSION = 1
+HEADER = struct.Struct("<4sBBHiiI")
+BOX_FIELDS = ("class_id", "left", "top", "width", "height")
+BOX_DTYPE = np.dtype("<i4")
+EXTENSION = ".ann"
+
+
+def encode(j):
+    size = j["image_size"][0]
+    path = j["file"].encode("utf8")
+    padding = -len(path) % 4
+    boxes = np.array([[annot[name] for name in BOX_FIELDS] for annot in j["annotations"]],
+                     dtype=BOX_DTYPE).reshape(-1, len(BOX_FIELDS))
+    return b"".join([
+        HEADER.pack(MAGIC, VERSION, size["depth"], len(path),
+                    size["width"], size["height"], len(boxes)),
+        path, b"\0" * padding, boxes.tobytes()])
+
+
+""" returns (path, (width, height, depth), boxes, next offset) with boxes
+    an (n, 5) int32 view into buf in BOX_FIELDS order """
+
+
+def decode_arrays(buf, offset=0):
+    magic, version, depth, path_len, width, height, num_boxes = \
+        HEADER.unpack_from(buf, offset)
+    if magic != MAGIC or version != VERSION:
+        raise ValueError("not a version {} annotation record at offset {}".format(VERSION, offset))
+    offset += HEADER.size
+    path = bytes(buf[offset:offset + path_len]).decode("utf8")
+    offset += path_len + (-path_len % 4)
+    boxes = np.frombuffer(buf, dtype=BOX_DTYPE, count=num_boxes * len(BOX_FIELDS),
+                          offset=offset).reshape(num_boxes, len(BOX_FIELDS))
+    return path, (width, height, depth), boxes, offset + boxes.nbytes
+
+
+def decode(buf, offset=0):
+    path, (width, height, depth), boxes, offset = decode_arrays(buf, offset)
+    annotations = [dict(zip(BOX_FIELDS, row)) for row in boxes.tolist()]
+    return {
+        "file": path,
+        "image_size": [{"width": width, "height": height, "depth": depth}],
+        "categories": [{"class_id": a["class_id"], "name": CLASS_IDS_MAP[a["class_id"]]}
+                       for a in annotations],
+        "annotations": annotations
+    }, offset
+
+
+def write(path, j):
+    with open(path, "wb") as f:
+        f.write(encode(j))
+    pass
+
+
+def read(path):
+    with open(path, "rb") as f:
+        return decode(f.read())[0]
+
+
+def write_pack(path, jsons):
+    with open(path, "wb") as f:
+        for j in jsons:
+            f.write(encode(j))
+    pass
+
+
+def iter_pack(path):
+    with open(path, "rb") as f:
+        buf = f.read()
+    offset = 0
+    while offset < len(buf):
+        j, offset = decode(buf, offset)
+        yield j
+
+
+""" yields (path, (width, height, depth), boxes) without building dicts """
+
+
+def iter_pack_arrays(path):
+    with open(path, "rb") as f:
+        buf = f.read()
+    offset = 0
+    while offset < len(buf):
+        path, size, boxes, offset = decode_arrays(buf, offset)
+        yield path, size, boxes
+
+
+""" converts every json in json_dir into a .ann per file in out_path,
+    or a single pack file when pack is set """
+
+
+def convert_json_dir(json_dir, out_path, pack=False):
+    file_names = sorted(f for f in os.listdir(json_dir)
+                        if f.endswith(".json") and not f.startswith("."))
+
+    def jsons():
+        for file_name in file_names:
+            with open(os.path.join(json_dir, file_name), "r") as f:
+                yield json.load(f)
+
+    if pack:
+        write_pack(out_path, jsons())
+        return len(file_names)
+    if not os.path.isdir(out_path):
+        os.makedirs(out_path)
+    for file_name, j in zip(file_names, jsons()):
+        write(os.path.join(out_path, os.path.splitext(file_name)[0] + EXTENSION), j)
+    return len(file_names)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("json_dir")
+    parser.add_argument("out_path")
+    parser.add_argument("--pack", action="store_true",
+                        help="write one pack file instead of a .ann per json")
+    args = parser.parse_args()
+    count = convert_json_dir(args.json_dir, args.out_path, args.pack)
+    print("Converted %d files to %s" % (count, args.out_path))
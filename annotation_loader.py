@@ -0,0 +1,96 @@
+""" 
+    Shared, memoized annotation loader
+
+    Parsed annotations are kept in an LRU cache keyed on path and
+    validated against the file's mtime and size on every lookup, so an
+    edited file is re-parsed. Callers get a cheap copy of the cached dict
+    since manips like BackgroundManip mutate annotations in place
+ """
+
+import collections
+import json
+import os
+import threading
+
+from dataset_format import parse_voc_xml
+
+
+""" copies the xml_dict_to_json schema, one level below each list is
+    enough since every leaf is an int or a string """
+
+
+def copy_annotation(j):
+    copied = dict(j)
+    for key in ("image_size", "categories", "annotations"):
+        if key in j:
+            copied[key] = [dict(item) for item in j[key]]
+    return copied
+
+
+def parse_annotation_file(path):
+    with open(path, "rb") as f:
+        data = f.read()
+    if path.endswith(".xml"):
+        return parse_voc_xml(data)
+    return json.loads(data.decode("utf8"))
+
+
+class AnnotationLoader():
+    def __init__(self, maxsize=8192):
+        self.maxsize = maxsize
+        self.cache = collections.OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+        pass
+
+    """ returns a copy of the annotation at path, a .xml is parsed as
+        VOC and anything else as json """
+
+    def load(self, path):
+        st = os.stat(path)
+        stamp = (st.st_mtime_ns, st.st_size)
+        with self.lock:
+            entry = self.cache.get(path)
+            if entry is not None and entry[0] == stamp:
+                self.cache.move_to_end(path)
+                self.hits += 1
+                return copy_annotation(entry[1])
+            if entry is not None:
+                self.invalidations += 1
+            self.misses += 1
+
+        j = parse_annotation_file(path)
+        with self.lock:
+            self.cache[path] = (stamp, j)
+            self.cache.move_to_end(path)
+            while len(self.cache) > self.maxsize:
+                self.cache.popitem(last=False)
+        return copy_annotation(j)
+
+    def invalidate(self, path=None):
+        with self.lock:
+            if path is None:
+                self.cache.clear()
+            else:
+                self.cache.pop(path, None)
+        pass
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "invalidations": self.invalidations,
+            "size": len(self.cache),
+            "hit_rate": float(self.hits) / lookups if lookups else 0.0
+        }
+
+
+# one loader per process shared by tfrecord_gen and the augmenter
+shared_loader = AnnotationLoader()
+
+
+def load_annotation(path):
+    return shared_loader.load(path)
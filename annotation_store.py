@@ -0,0 +1,166 @@
+""" 
+    Consolidated columnar store for a whole annotation set
+
+    A file table (path, width, height) and a box table (file_index,
+    class_id, left, top, width, height) kept as flat numpy columns and saved
+    as one .npy per column in a directory, so np.load can mmap them and a
+    dataset loads in milliseconds instead of opening every json
+
+    python annotation_store.py final_train final_train_store
+ """
+
+import argparse
+import json
+import os
+
+import numpy as np
+
+from dataset_format import CLASSES, CLASSES_MAP, CLASS_IDS_MAP
+
+FILE_COLUMNS = ("width", "height")
+BOX_COLUMNS = ("file_index", "class_id", "left", "top", "width", "height")
+
+
+class AnnotationStore():
+    """ paths is an array of strings, files maps FILE_COLUMNS to arrays
+        with one row per file, boxes maps BOX_COLUMNS to arrays with one row
+        per box sorted by file_index """
+
+    def __init__(self, paths, files, boxes):
+        self.paths = paths
+        self.files = files
+        self.boxes = boxes
+        # boxes of file i are offsets[i]:offsets[i + 1]
+        self.offsets = np.searchsorted(
+            boxes["file_index"], np.arange(len(paths) + 1)).astype(np.int64)
+        pass
+
+    @classmethod
+    def from_jsons(cls, jsons):
+        paths = []
+        files = {name: [] for name in FILE_COLUMNS}
+        boxes = {name: [] for name in BOX_COLUMNS}
+        for i, j in enumerate(jsons):
+            paths.append(j["file"])
+            files["width"].append(j["image_size"][0]["width"])
+            files["height"].append(j["image_size"][0]["height"])
+            for annot in j["annotations"]:
+                boxes["file_index"].append(i)
+                for name in BOX_COLUMNS[1:]:
+                    boxes[name].append(annot[name])
+        return cls(np.array(paths, dtype=np.str_),
+                   {name: np.array(col, dtype=np.int32) for name, col in files.items()},
+                   {name: np.array(col, dtype=np.int32) for name, col in boxes.items()})
+
+    @classmethod
+    def from_json_dir(cls, json_dir):
+        def jsons():
+            for file_name in sorted(os.listdir(json_dir)):
+                # dotfiles are caches and manifests of the tools
+                if file_name.endswith(".json") and not file_name.startswith("."):
+                    with open(os.path.join(json_dir, file_name), "r") as f:
+                        yield json.load(f)
+        return cls.from_jsons(jsons())
+
+    def save(self, directory):
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        np.save(os.path.join(directory, "paths.npy"), self.paths)
+        for name, col in self.files.items():
+            np.save(os.path.join(directory, "file_{}.npy".format(name)), col)
+        for name, col in self.boxes.items():
+            np.save(os.path.join(directory, "box_{}.npy".format(name)), col)
+        pass
+
+    @classmethod
+    def load(cls, directory, mmap=True):
+        mode = "r" if mmap else None
+        paths = np.load(os.path.join(directory, "paths.npy"), mmap_mode=mode)
+        files = {name: np.load(os.path.join(directory, "file_{}.npy".format(name)),
+                               mmap_mode=mode) for name in FILE_COLUMNS}
+        boxes = {name: np.load(os.path.join(directory, "box_{}.npy".format(name)),
+                               mmap_mode=mode) for name in BOX_COLUMNS}
+        return cls(paths, files, boxes)
+
+    def __len__(self):
+        return len(self.paths)
+
+    @property
+    def num_boxes(self):
+        return len(self.boxes["file_index"])
+
+    def box_range(self, file_index):
+        return slice(self.offsets[file_index], self.offsets[file_index + 1])
+
+    """ columns of the boxes in file i """
+
+    def boxes_for_file(self, file_index):
+        rows = self.box_range(file_index)
+        return {name: col[rows] for name, col in self.boxes.items()}
+
+    """ returns indices of the boxes matching every given condition,
+        class_name or class_id, files (array of file indices) and sizes in
+        pixels, smaller_than keeps boxes whose width and height are both
+        below it, larger_than boxes whose width and height are both above it
+        e.g. store.select(class_name="red4", smaller_than=50) """
+
+    def select(self, class_name=None, class_id=None, files=None,
+               smaller_than=None, larger_than=None):
+        mask = np.ones(self.num_boxes, dtype=bool)
+        if class_name is not None:
+            class_id = CLASSES_MAP[class_name]
+        if class_id is not None:
+            mask &= self.boxes["class_id"] == class_id
+        if files is not None:
+            mask &= np.isin(self.boxes["file_index"], files)
+        if smaller_than is not None:
+            mask &= np.maximum(self.boxes["width"], self.boxes["height"]) < smaller_than
+        if larger_than is not None:
+            mask &= np.minimum(self.boxes["width"], self.boxes["height"]) > larger_than
+        return np.flatnonzero(mask)
+
+    def box_rows(self, indices):
+        return {name: col[indices] for name, col in self.boxes.items()}
+
+    """ (files, classes) count matrix, the vectorized form of
+        metrics.vectorize_dict over every file at once """
+
+    def class_counts(self):
+        counts = np.zeros((len(self), len(CLASSES)), dtype=np.int64)
+        np.add.at(counts, (self.boxes["file_index"], self.boxes["class_id"]), 1)
+        return counts
+
+    """ rebuilds file i in the xml_dict_to_json schema """
+
+    def to_json(self, file_index):
+        boxes = self.boxes_for_file(file_index)
+        annotations = [{
+            "class_id": int(class_id),
+            "left": int(left),
+            "top": int(top),
+            "width": int(width),
+            "height": int(height)
+        } for class_id, left, top, width, height in zip(
+            boxes["class_id"], boxes["left"], boxes["top"], boxes["width"], boxes["height"])]
+        return {
+            "file": str(self.paths[file_index]),
+            "image_size": [{
+                "width": int(self.files["width"][file_index]),
+                "height": int(self.files["height"][file_index]),
+                "depth": 3
+            }],
+            "categories": [{"class_id": a["class_id"], "name": CLASS_IDS_MAP[a["class_id"]]}
+                           for a in annotations],
+            "annotations": annotations
+        }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("json_dir")
+    parser.add_argument("store_dir")
+    args = parser.parse_args()
+
+    store = AnnotationStore.from_json_dir(args.json_dir)
+    store.save(args.store_dir)
+    print("Stored %d files, %d boxes in %s" % (len(store), store.num_boxes, args.store_dir))
@@ -0,0 +1,87 @@
+""" 
+    Soak run for the augmentation pipeline, pushes synthetic samples
+    through background, noise and contrast manips with every image going
+    through an ImageLedger, and fails if RSS keeps growing after warmup
+    or if any image is left alive at the end
+
+    python augment_soak.py --samples 50000
+ """
+
+import argparse
+import io
+import os
+import resource
+import sys
+import tempfile
+
+from data_augmenting import (BackgroundManip, ContrastManip, GaussianManip,
+                             ImageLedger, ManipPipeline, StripTiler, release_image)
+from synthetic_data import synthetic_samples, write_backgrounds
+
+
+def current_rss_bytes():
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (IOError, OSError):
+        # peak instead of current, still catches steady growth
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def soak(samples, width, height, max_boxes, window, max_bytes):
+    ledger = ImageLedger(max_bytes=max_bytes)
+    tiler = StripTiler()
+    rss = []
+    with tempfile.TemporaryDirectory() as background_dir:
+        write_backgrounds(background_dir, 4, width, height)
+        pipeline = ManipPipeline()
+        pipeline.append_chain(BackgroundManip(background_dir, circular=True, border_size=10))
+        pipeline.append_chain(GaussianManip(0, 100, tiler=tiler))
+        pipeline.append_chain(ContrastManip(40, 0))
+
+        for i, (image, json) in enumerate(synthetic_samples(
+                samples, width, height, max_boxes=max_boxes, ledger=ledger)):
+            a_image, json = pipeline.manip(image, json)
+            ledger.track(a_image)
+            buf = io.BytesIO()
+            a_image.save(buf, "JPEG")
+            release_image(a_image, ledger)
+            release_image(image, ledger)
+            if i % window == window - 1:
+                rss.append(current_rss_bytes())
+                print("Iteration %d rss %.1f MB live %d" %
+                      (i, rss[-1] / 2.0**20, ledger.live_handles()))
+    return ledger, rss
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--samples", type=int, default=50000)
+    parser.add_argument("--width", type=int, default=640)
+    parser.add_argument("--height", type=int, default=360)
+    parser.add_argument("--max-boxes", type=int, default=3)
+    parser.add_argument("--window", type=int, default=1000,
+                        help="samples between rss readings")
+    parser.add_argument("--warmup", type=float, default=0.1,
+                        help="fraction of the run ignored before rss must stay flat")
+    parser.add_argument("--tolerance-mb", type=float, default=16.0)
+    parser.add_argument("--max-bytes", type=int, default=64 << 20,
+                        help="ledger memory ceiling")
+    args = parser.parse_args()
+
+    ledger, rss = soak(args.samples, args.width, args.height, args.max_boxes,
+                       args.window, args.max_bytes)
+
+    failures = []
+    if ledger.live_handles() != 0:
+        failures.append("%d images still alive" % ledger.live_handles())
+    steady = rss[int(len(rss) * args.warmup):]
+    if len(steady) >= 2:
+        growth = (max(steady) - steady[0]) / 2.0**20
+        print("rss growth after warmup %.1f MB, peak live bytes %d" %
+              (growth, ledger.peak_bytes))
+        if growth > args.tolerance_mb:
+            failures.append("rss grew %.1f MB after warmup" % growth)
+    for failure in failures:
+        print("FAIL", failure)
+    sys.exit(1 if failures else 0)
@@ -0,0 +1,83 @@
+""" 
+    Load time of annotations as pretty printed json files against
+    .ann files and a single pack file, on synthetic annotations
+
+    python bench_annotation_binary.py --files 100000
+ """
+
+import argparse
+import json
+import os
+import tempfile
+import time
+
+import numpy as np
+
+import annotation_binary
+from bench_util import summarize, write_results
+from synthetic_data import synthetic_json
+
+
+def timed(fn):
+    start = time.perf_counter()
+    result = fn()
+    return time.perf_counter() - start, result
+
+
+def load_jsons(directory, file_names):
+    out = []
+    for file_name in file_names:
+        with open(os.path.join(directory, file_name), "r") as f:
+            out.append(json.load(f))
+    return out
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--files", type=int, default=100000)
+    parser.add_argument("--max-boxes", type=int, default=5)
+    parser.add_argument("--out", default="bench_annotation_binary.json")
+    args = parser.parse_args()
+
+    jsons = [synthetic_json(n, file_name=".\\all_drive\\blue_drive_{}.jpg".format(i))
+             for i, n in enumerate(np.random.randint(1, args.max_boxes + 1, size=args.files))]
+
+    with tempfile.TemporaryDirectory() as tmp:
+        json_names = []
+        ann_names = []
+        for i, j in enumerate(jsons):
+            json_names.append("{}.json".format(i))
+            with open(os.path.join(tmp, json_names[-1]), "w") as f:
+                json.dump(j, f, indent=4)
+            ann_names.append("{}{}".format(i, annotation_binary.EXTENSION))
+            annotation_binary.write(os.path.join(tmp, ann_names[-1]), j)
+        pack_path = os.path.join(tmp, "all.annpack")
+        annotation_binary.write_pack(pack_path, jsons)
+
+        def dir_bytes(names):
+            return sum(os.path.getsize(os.path.join(tmp, name)) for name in names)
+        sizes = {"json": dir_bytes(json_names), "ann": dir_bytes(ann_names),
+                 "pack": os.path.getsize(pack_path)}
+
+        runs = {
+            "json_load": lambda: load_jsons(tmp, json_names),
+            "ann_read": lambda: [annotation_binary.read(os.path.join(tmp, name))
+                                 for name in ann_names],
+            "pack_read": lambda: list(annotation_binary.iter_pack(pack_path)),
+            "pack_arrays": lambda: list(annotation_binary.iter_pack_arrays(pack_path)),
+        }
+        results = {}
+        for name, fn in runs.items():
+            seconds, loaded = timed(fn)
+            if name == "pack_arrays":
+                assert len(loaded) == len(jsons), name
+            else:
+                assert loaded == jsons, name
+            results[name] = summarize([seconds], items_per_call=args.files)
+            results[name]["total_s"] = seconds
+            print("%-12s %8.3f s %10.0f annotations/s" %
+                  (name, seconds, results[name]["items_per_s"]))
+
+    for name, size in sizes.items():
+        print("%-12s %8.1f MB" % (name, size / 2.0**20))
+    write_results(args.out, "annotation_binary", results, dict(vars(args), bytes=sizes))
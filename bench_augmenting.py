@@ -0,0 +1,95 @@
+""" 
+    Benchmarks for the augmentation manips, randomly_place_boxes,
+    the full manip chain and the driver loop on synthetic 1080p frames
+    with 1 to 30 boxes, results go to a json file
+
+    python bench_augmenting.py --out bench_augmenting.json
+    python bench_augmenting.py --compare old.json --out new.json
+ """
+
+import argparse
+import copy
+import os
+import tempfile
+
+import numpy as np
+
+import data_augmenting
+from data_augmenting import (BackgroundManip, ContrastManip, GaussianManip,
+                             ManipPipeline, StripTiler, randomly_place_boxes, save_sample)
+from bench_util import compare_results, measure, print_result, write_results
+from synthetic_data import synthetic_frame, synthetic_json, write_backgrounds
+
+
+def run(args, background_dir):
+    frames = [synthetic_frame(args.width, args.height) for _ in range(4)]
+    jsons = [synthetic_json(n, args.width, args.height)
+             for n in np.random.randint(args.min_boxes, args.max_boxes + 1, size=64)]
+
+    def sample():
+        # manips mutate the json in place so every call gets its own copy
+        i = np.random.randint(len(jsons))
+        return frames[i % len(frames)], copy.deepcopy(jsons[i])
+
+    tiler = StripTiler()
+    background = BackgroundManip(background_dir, circular=True, border_size=30)
+    chain = ManipPipeline()
+    chain.append_chain(background)
+    chain.append_chain(GaussianManip(0, 100, tiler=tiler))
+    chain.append_chain(ContrastManip(40, 0))
+
+    cases = {
+        "gaussian": (GaussianManip(0, 100).manip, sample),
+        "gaussian_tiled": (GaussianManip(0, 100, tiler=tiler).manip, sample),
+        "contrast": (ContrastManip(40, 0).manip, sample),
+        "background": (background.manip, sample),
+        "chain": (chain.manip, sample),
+    }
+    for num_boxes in (1, 10, 30):
+        dims = [(a["width"] // 2, a["height"] // 2)
+                for a in synthetic_json(num_boxes, args.width, args.height)["annotations"]]
+        cases["place_boxes_{}".format(num_boxes)] = (
+            randomly_place_boxes, lambda dims=dims: (args.width, args.height, dims))
+
+    def driver(image, json, index=[0]):
+        a_image, json = chain.manip(image, json)
+        save_sample(a_image, json, index[0] % 16)
+        a_image.close()
+        index[0] += 1
+    cases["driver"] = (driver, sample)
+
+    results = {}
+    for name, (fn, setup) in cases.items():
+        if args.only and name not in args.only:
+            continue
+        results[name] = measure(fn, args.repeats, setup)
+        print_result(name, results[name])
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--repeats", type=int, default=30)
+    parser.add_argument("--width", type=int, default=1920)
+    parser.add_argument("--height", type=int, default=1080)
+    parser.add_argument("--min-boxes", type=int, default=1)
+    parser.add_argument("--max-boxes", type=int, default=30)
+    parser.add_argument("--only", nargs="*", help="case names to run")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--out", default="bench_augmenting.json")
+    parser.add_argument("--compare", help="earlier results json to compare against")
+    args = parser.parse_args()
+
+    np.random.seed(args.seed)
+    with tempfile.TemporaryDirectory() as tmp:
+        background_dir = os.path.join(tmp, "backgrounds")
+        os.makedirs(background_dir)
+        write_backgrounds(background_dir, 4, args.width, args.height)
+        data_augmenting.TEST_PATH = tmp
+        os.makedirs(os.path.join(tmp, "image"))
+        os.makedirs(os.path.join(tmp, "json"))
+        results = run(args, background_dir)
+
+    write_results(args.out, "augmenting", results, vars(args))
+    if args.compare:
+        compare_results(args.compare, args.out)
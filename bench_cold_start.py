@@ -0,0 +1,44 @@
+""" 
+    Cold start time of importing modules in a fresh interpreter,
+    run it before and after a change and compare the json files
+
+    python bench_cold_start.py --out after.json --compare before.json
+ """
+
+import argparse
+import subprocess
+import sys
+import time
+
+import numpy as np
+
+from bench_util import compare_results, print_result, summarize, write_results
+
+DEFAULT_MODULES = ["dataset_util", "tfrecord_gen", "dataset_format", "data_augmenting"]
+
+
+def cold_start(module, repeats):
+    latencies = np.empty(repeats)
+    for i in range(repeats):
+        start = time.perf_counter()
+        subprocess.check_call([sys.executable, "-c", "import " + module])
+        latencies[i] = time.perf_counter() - start
+    return summarize(latencies)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--modules", nargs="*", default=DEFAULT_MODULES)
+    parser.add_argument("--repeats", type=int, default=10)
+    parser.add_argument("--out", default="bench_cold_start.json")
+    parser.add_argument("--compare", help="earlier results json to compare against")
+    args = parser.parse_args()
+
+    results = {"python": cold_start("sys", args.repeats)}
+    for module in args.modules:
+        results[module] = cold_start(module, args.repeats)
+    for name, result in results.items():
+        print_result(name, result)
+    write_results(args.out, "cold_start", results, vars(args))
+    if args.compare:
+        compare_results(args.compare, args.out)
@@ -0,0 +1,64 @@
+""" 
+    Benchmarks parse_voc_xml against the xmltodict path
+    (file_name_to_dict + xml_dict_to_json) on synthetic VOC files
+    and checks both produce the same json
+
+    python bench_dataset_format.py --files 10000
+ """
+
+import argparse
+import os
+import tempfile
+import time
+
+import numpy as np
+
+from dataset_format import file_name_to_dict, file_name_to_json, xml_dict_to_json
+from bench_util import summarize, print_result, write_results
+from synthetic_data import synthetic_json, synthetic_voc_xml
+
+
+def write_xmls(directory, count, max_boxes):
+    file_names = []
+    for i in range(count):
+        file_name = "blue_drive_{}.xml".format(i)
+        j = synthetic_json(np.random.randint(1, max_boxes + 1),
+                           file_name="blue_drive_{}.jpg".format(i))
+        with open(os.path.join(directory, file_name), "w") as f:
+            f.write(synthetic_voc_xml(j))
+        file_names.append(file_name)
+    return file_names
+
+
+def time_each(fn, file_names):
+    latencies = np.empty(len(file_names))
+    outputs = []
+    for i, file_name in enumerate(file_names):
+        start = time.perf_counter()
+        outputs.append(fn(file_name))
+        latencies[i] = time.perf_counter() - start
+    return summarize(latencies), outputs
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--files", type=int, default=10000)
+    parser.add_argument("--max-boxes", type=int, default=5)
+    parser.add_argument("--out", default="bench_dataset_format.json")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as xml_dir:
+        file_names = write_xmls(xml_dir, args.files, args.max_boxes)
+
+        results = {}
+        results["xmltodict"], old = time_each(
+            lambda f: xml_dict_to_json(file_name_to_dict(f, xml_dir)), file_names)
+        results["parse_voc_xml"], new = time_each(
+            lambda f: file_name_to_json(f, xml_dir), file_names)
+
+    assert old == new, "parsers disagree"
+    for name, result in results.items():
+        print_result(name, result)
+    print("speedup %.2fx" % (results["parse_voc_xml"]["items_per_s"] /
+                             results["xmltodict"]["items_per_s"]))
+    write_results(args.out, "dataset_format", results, vars(args))
@@ -0,0 +1,69 @@
+""" 
+        Benchmarks dataset_util.parse_xml_to_dict and iter_xml_objects
+        against the old recursive parser on large multi-object annotations
+
+        python bench_dataset_util.py --objects 1000
+  """
+
+import argparse
+import io
+import time
+from xml.etree import ElementTree
+
+import numpy as np
+
+import dataset_util
+from bench_util import summarize, print_result, write_results
+from synthetic_data import synthetic_json, synthetic_voc_xml
+
+
+def recursive_reference(xml):
+    """The recursive parser dataset_util used to ship, for comparison."""
+    if not len(xml):
+        return {xml.tag: xml.text}
+    result = {}
+    for child in xml:
+        child_result = recursive_reference(child)
+        if child.tag != 'object':
+            result[child.tag] = child_result[child.tag]
+        else:
+            if child.tag not in result:
+                result[child.tag] = []
+            result[child.tag].append(child_result[child.tag])
+    return {xml.tag: result}
+
+
+def time_calls(fn, repeats):
+    latencies = np.empty(repeats)
+    for i in range(repeats):
+        start = time.perf_counter()
+        result = fn()
+        latencies[i] = time.perf_counter() - start
+    return summarize(latencies), result
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--objects", type=int, default=1000)
+    parser.add_argument("--repeats", type=int, default=20)
+    parser.add_argument("--out", default="bench_dataset_util.json")
+    args = parser.parse_args()
+
+    data = synthetic_voc_xml(synthetic_json(args.objects)).encode("utf8")
+    tree = ElementTree.fromstring(data)
+
+    results = {}
+    results["recursive"], expected = time_calls(
+            lambda: recursive_reference(tree), args.repeats)
+    results["iterative"], parsed = time_calls(
+            lambda: dataset_util.parse_xml_to_dict(tree), args.repeats)
+    assert parsed == expected, "parsers disagree"
+    results["parse_and_iterative"], _ = time_calls(
+            lambda: dataset_util.parse_xml_to_dict(ElementTree.fromstring(data)), args.repeats)
+    results["streaming_objects"], objects = time_calls(
+            lambda: list(dataset_util.iter_xml_objects(io.BytesIO(data))), args.repeats)
+    assert objects == expected["annotation"]["object"], "streaming disagrees"
+
+    for name, result in results.items():
+        print_result(name, result)
+    write_results(args.out, "dataset_util", results, vars(args))
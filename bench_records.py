@@ -0,0 +1,160 @@
+""" 
+    Record generation benchmarks on synthetic frames
+
+    reencode: record bytes and build time with the original JPEGs against
+    the json_to_record re-encode stage, and decode throughput of the stored
+    images as a stand-in for the training input pipeline
+
+    serialize: per record cost of json_to_record against ExampleBuilder,
+    end to end and with the image bytes already in memory
+
+    codecs: file size, write and read throughput of the records for each
+    compression type, on the synthetic records or on existing record files
+    given with --records
+
+    python bench_records.py --samples 100 --max-side 300
+ """
+
+import argparse
+import glob
+import io
+import os
+import tempfile
+import time
+
+import numpy as np
+from PIL import Image
+
+import tfrecord_gen
+import tfrecord_io
+from bench_util import print_result, summarize, write_results
+from path_resolver import PathResolver
+from synthetic_data import synthetic_json
+
+
+""" writes count jpegs and their jsons, frames are smooth gradients with
+    noise so they compress like camera frames rather than pure noise """
+
+
+def write_samples(directory, count, width, height):
+    jsons = []
+    ramp = np.linspace(0, 255, width, dtype=np.float32)
+    for i in range(count):
+        pixels = np.empty((height, width, 3), dtype=np.float32)
+        pixels[...] = ramp[None, :, None] * np.random.uniform(0.3, 1.0, size=3)
+        pixels += np.random.normal(0, 8, size=pixels.shape)
+        file_name = "blue_drive_{}.jpg".format(i)
+        Image.fromarray(np.clip(pixels, 0, 255).astype(np.uint8), "RGB").save(
+            os.path.join(directory, file_name), quality=95)
+        jsons.append(synthetic_json(np.random.randint(1, 6), width, height,
+                                    ".\\all_drive\\" + file_name))
+    return jsons
+
+
+def build_records(jsons, resolver, **kwargs):
+    latencies = np.empty(len(jsons))
+    records = []
+    for i, j in enumerate(jsons):
+        start = time.perf_counter()
+        records.append(tfrecord_gen.json_to_record(j, resolver, **kwargs).SerializeToString())
+        latencies[i] = time.perf_counter() - start
+    return summarize(latencies), records
+
+
+def decode_records(records):
+    latencies = np.empty(len(records))
+    for i, record in enumerate(records):
+        example = tfrecord_gen.example_proto.Example()
+        start = time.perf_counter()
+        example.ParseFromString(record)
+        encoded = example.features.feature["image/encoded"].bytes_list.value[0]
+        with Image.open(io.BytesIO(encoded)) as img:
+            img.load()
+        latencies[i] = time.perf_counter() - start
+    return summarize(latencies)
+
+
+def bench_reencode(args, jsons, resolver, results):
+    for label, kwargs in (("original", {}),
+                          ("reencode", {"max_side": args.max_side, "quality": args.quality})):
+        results[label + "_build"], records = build_records(jsons, resolver, **kwargs)
+        results[label + "_build"]["record_bytes"] = sum(len(r) for r in records)
+        results[label + "_decode"] = decode_records(records)
+    for label in ("original", "reencode"):
+        print("%-10s %8.1f MB" % (label, results[label + "_build"]["record_bytes"] / 2.0**20))
+    return records
+
+
+def bench_serialize(jsons, resolver, results, repeat):
+    builder = tfrecord_gen.ExampleBuilder(resolver)
+    for j in jsons:
+        expected = tfrecord_gen.json_to_record(j, resolver)
+        assert builder.build(j) == expected, j["file"]
+
+    images = [tfrecord_gen.load_image_data(j, resolver) for j in jsons]
+    runs = (("json_to_record", lambda j, image: tfrecord_gen.json_to_record(j, resolver).SerializeToString()),
+            ("builder", lambda j, image: builder.serialize(j)),
+            ("builder_fill", lambda j, image: builder.fill(j, *image).SerializeToString()))
+    for label, run in runs:
+        latencies = np.empty(len(jsons) * repeat)
+        for i in range(len(latencies)):
+            j = jsons[i % len(jsons)]
+            start = time.perf_counter()
+            run(j, images[i % len(jsons)])
+            latencies[i] = time.perf_counter() - start
+        results["serialize_" + label] = summarize(latencies)
+
+
+def bench_codecs(records, results, directory):
+    raw_bytes = sum(len(r) for r in records)
+    for compression in ("NONE", "GZIP", "ZLIB"):
+        path = os.path.join(directory, "codec.record")
+        start = time.perf_counter()
+        writer = tfrecord_io.TFRecordWriter(path, compression)
+        for record in records:
+            writer.write(record)
+        writer.close()
+        write_s = time.perf_counter() - start
+
+        start = time.perf_counter()
+        count = sum(1 for _ in tfrecord_io.tf_record_iterator(path, True, compression))
+        read_s = time.perf_counter() - start
+        assert count == len(records)
+
+        size = os.path.getsize(path)
+        results["codec_" + compression.lower()] = dict(
+            summarize([write_s], len(records)), file_bytes=size,
+            write_mb_s=raw_bytes / 2.0**20 / write_s, read_mb_s=raw_bytes / 2.0**20 / read_s)
+        print("%-5s %8.1f MB (%5.1f%%)  write %7.1f MB/s  read %7.1f MB/s" % (
+            compression, size / 2.0**20, 100.0 * size / raw_bytes,
+            raw_bytes / 2.0**20 / write_s, raw_bytes / 2.0**20 / read_s))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--samples", type=int, default=100)
+    parser.add_argument("--width", type=int, default=1920)
+    parser.add_argument("--height", type=int, default=1080)
+    parser.add_argument("--max-side", type=int, default=300)
+    parser.add_argument("--quality", type=int, default=tfrecord_gen.RECORD_JPEG_QUALITY)
+    parser.add_argument("--repeat", type=int, default=20,
+                        help="passes over the samples for the serialize benchmark")
+    parser.add_argument("--records", default=None,
+                        help="glob of existing record files for the codec benchmark")
+    parser.add_argument("--out", default="bench_records.json")
+    args = parser.parse_args()
+
+    results = {}
+    with tempfile.TemporaryDirectory() as image_dir:
+        jsons = write_samples(image_dir, args.samples, args.width, args.height)
+        resolver = PathResolver([image_dir])
+        records = bench_reencode(args, jsons, resolver, results)
+        bench_serialize(jsons, resolver, results, args.repeat)
+        if args.records:
+            records = [r for path in sorted(glob.glob(args.records))
+                       for r in tfrecord_io.tf_record_iterator(path)]
+        bench_codecs(records, results, image_dir)
+
+    for name, result in results.items():
+        print_result(name, result)
+    write_results(args.out, "records", results, vars(args))
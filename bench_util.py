@@ -0,0 +1,104 @@
+""" 
+    Shared helpers for the bench_*.py scripts: timing calls,
+    latency percentiles, peak memory and json result files that can be
+    compared between runs
+ """
+
+import json
+import platform
+import resource
+import sys
+import time
+import tracemalloc
+
+import numpy as np
+
+
+""" calls fn(*setup()) repeats times and returns a summary dict,
+    setup runs outside the timed region. Peak memory is measured in
+    separate memory_repeats calls afterwards, tracemalloc hooks every
+    allocation and would slow the timed calls. It is what tracemalloc sees
+    (python objects and numpy buffers) plus the process high water mark """
+
+
+def measure(fn, repeats, setup=None, items_per_call=1, warmup=1, memory_repeats=1):
+    for _ in range(warmup):
+        fn(*(setup() if setup is not None else ()))
+
+    latencies = np.empty(repeats)
+    for i in range(repeats):
+        args = setup() if setup is not None else ()
+        start = time.perf_counter()
+        fn(*args)
+        latencies[i] = time.perf_counter() - start
+
+    peak = 0
+    for _ in range(memory_repeats):
+        args = setup() if setup is not None else ()
+        tracemalloc.start()
+        fn(*args)
+        peak = max(peak, tracemalloc.get_traced_memory()[1])
+        tracemalloc.stop()
+
+    result = summarize(latencies, items_per_call)
+    result["peak_traced_mb"] = peak / 2.0**20
+    result["max_rss_mb"] = max_rss_mb()
+    return result
+
+
+def summarize(latencies, items_per_call=1):
+    latencies = np.asarray(latencies)
+    total = latencies.sum()
+    return {
+        "calls": int(len(latencies)),
+        "mean_ms": float(latencies.mean() * 1e3),
+        "p50_ms": float(np.percentile(latencies, 50) * 1e3),
+        "p90_ms": float(np.percentile(latencies, 90) * 1e3),
+        "p99_ms": float(np.percentile(latencies, 99) * 1e3),
+        "items_per_s": float(len(latencies) * items_per_call / total) if total > 0 else 0.0,
+    }
+
+
+def max_rss_mb():
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on linux, bytes on macos
+    if sys.platform == "darwin":
+        return rss / 2.0**20
+    return rss / 2.0**10
+
+
+def print_result(name, result):
+    print("{:<32} {:>10.1f}/s  p50 {:>9.3f} ms  p99 {:>9.3f} ms  peak {:>8.1f} MB".format(
+        name, result["items_per_s"], result["p50_ms"], result["p99_ms"],
+        result.get("peak_traced_mb", 0.0)))
+
+
+def write_results(path, suite, results, params=None):
+    doc = {
+        "suite": suite,
+        "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "machine": platform.machine(),
+        "params": params or {},
+        "results": results,
+    }
+    with open(path, "w") as f:
+        json.dump(doc, f, indent=4)
+    pass
+
+
+""" prints throughput and p50 of new against old for the cases both runs share """
+
+
+def compare_results(old_path, new_path):
+    with open(old_path) as f:
+        old = json.load(f)["results"]
+    with open(new_path) as f:
+        new = json.load(f)["results"]
+    print("{:<32} {:>12} {:>12}".format("case", "throughput", "p50"))
+    for name in sorted(set(old) & set(new)):
+        speedup = new[name]["items_per_s"] / max(old[name]["items_per_s"], 1e-12)
+        p50 = new[name]["p50_ms"] / max(old[name]["p50_ms"], 1e-12)
+        print("{:<32} {:>11.2f}x {:>11.2f}x".format(name, speedup, p50))
+    pass
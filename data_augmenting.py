@@ -14,8 +14,10 @@
 from PIL import Image, ImageDraw, ImageChops
 import numpy as np
 import os
+import queue
+import threading
 from metrics import box_overlaps_regions, naive_classification_accuracy
-from dataset_format import file_name_to_json
+from annotation_loader import load_annotation
 from json import dump
 
 from operator import itemgetter
@@ -28,6 +30,22 @@ BACKGROUND_PATH = os.path.join(".", "backgrounds")
 
 OUTPUT_PREFIX = "mixed"
 
+# bytes of scratch memory a strip should occupy, roughly an L2 cache
+STRIP_CACHE_BYTES = 1 << 20
+
+# live pixel bytes above which sample_generator holds back new samples
+MEMORY_CEILING_BYTES = 256 << 20
+# samples loaded ahead of the consumer by the sample_generator thread
+PREFETCH_DEPTH = 4
+
+# output mode, frames and boxes are resized to OUTPUT_SIZE (width, height)
+# or so the longest side is OUTPUT_MAX_SIDE before encoding, None keeps
+# the full resolution. SSD MobileNet takes 300x300 inputs
+OUTPUT_SIZE = None
+OUTPUT_MAX_SIDE = None
+JPEG_QUALITY = 75
+JPEG_SUBSAMPLING = "4:2:0"
+
 """ base class for image manipulation strategies """
 
 
@@ -41,16 +59,112 @@ class ImageManip():
         raise Exception("not implemented")
 
 
-""" Adds gaussian noise to the pixels of an image """
+""" Keeps count of the images alive during an augmentation run and of
+    the bytes their pixels take. release() closes an image and forgets it.
+    With max_bytes set, wait_for_capacity() blocks a producer thread until
+    consumers on other threads have released enough, raising MemoryError
+    after timeout seconds. Only call it from a producer thread such as the
+    one of prefetch_samples, the consumer waiting on itself can't release """
+
+
+class ImageLedger():
+    def __init__(self, max_bytes=None, timeout=60.0):
+        self.max_bytes = max_bytes
+        self.timeout = timeout
+        self.live = {}
+        self.live_bytes = 0
+        self.peak_bytes = 0
+        self.condition = threading.Condition()
+        pass
+
+    def track(self, image):
+        nbytes = image.width * image.height * len(image.getbands())
+        with self.condition:
+            if id(image) not in self.live:
+                self.live[id(image)] = (image, nbytes)
+                self.live_bytes += nbytes
+                self.peak_bytes = max(self.peak_bytes, self.live_bytes)
+        return image
+
+    def release(self, image):
+        with self.condition:
+            entry = self.live.pop(id(image), None)
+            if entry is not None:
+                self.live_bytes -= entry[1]
+                self.condition.notify_all()
+        image.close()
+
+    def live_handles(self):
+        return len(self.live)
+
+    def wait_for_capacity(self):
+        if self.max_bytes is None:
+            return
+        with self.condition:
+            if not self.condition.wait_for(lambda: self.live_bytes < self.max_bytes,
+                                           timeout=self.timeout):
+                raise MemoryError("{} bytes held by {} live images, ceiling is {}".format(
+                    self.live_bytes, len(self.live), self.max_bytes))
+        pass
+
+
+""" closes an image through the ledger when there is one """
+
+
+def release_image(image, ledger=None):
+    if ledger is not None:
+        ledger.release(image)
+    else:
+        image.close()
+
+
+""" Walks a frame in horizontal strips sized to fit in cache
+    and owns one scratch buffer that is reused for every strip and every call,
+    share a single instance between the manips of a worker """
+
+
+class StripTiler():
+    def __init__(self, cache_bytes=STRIP_CACHE_BYTES):
+        self.cache_bytes = cache_bytes
+        self.scratch = np.empty(0, dtype=np.uint8)
+        pass
+
+    """ yields (top, bottom) row ranges covering the frame """
+
+    def strips(self, width, height, channels, dtype):
+        row_bytes = width * channels * np.dtype(dtype).itemsize
+        rows = max(1, self.cache_bytes // row_bytes)
+        for top in range(0, height, rows):
+            yield top, min(top + rows, height)
+        pass
+
+    """ returns a (rows, width, channels) view into the scratch buffer,
+        only grows the buffer, never shrinks it """
+
+    def scratch_view(self, rows, width, channels, dtype):
+        dtype = np.dtype(dtype)
+        nbytes = rows * width * channels * dtype.itemsize
+        if self.scratch.nbytes < nbytes:
+            self.scratch = np.empty(nbytes, dtype=np.uint8)
+        return self.scratch[:nbytes].view(dtype).reshape(rows, width, channels)
+        pass
+
+
+""" Adds gaussian noise to the pixels of an image
+    pass a StripTiler to process the frame strip by strip,
+    the output is identical for the same random state """
 
 
 class GaussianManip(ImageManip):
-    def __init__(self, mu, variance):
+    def __init__(self, mu, variance, tiler=None):
         self.mu = mu
         self.variance = variance
         self.stddev = np.sqrt(self.variance)
+        self.tiler = tiler
 
     def manip(self, image, json_dat):
+        if self.tiler is not None:
+            return self.manip_tiled(image, json_dat)
         noise = np.random.normal(
             loc=self.mu, scale=self.stddev, size=(image.height, image.width, 3))
 
@@ -62,6 +176,27 @@ class GaussianManip(ImageManip):
 
         return Image.fromarray(np.uint8(res), "RGB"), json_dat
         pass
+
+    def manip_tiled(self, image, json_dat):
+        if image.mode != "RGB":
+            return image, json_dat
+        width = image.width
+        # only strips of the source are copied out and the results are
+        # pasted into the output frame, no full frame array is made
+        out = Image.new("RGB", image.size)
+        # noise is drawn strip by strip in row order which consumes
+        # the random stream exactly like one full frame draw
+        for top, bottom in self.tiler.strips(width, image.height, 3, np.float64):
+            rows = bottom - top
+            buf = self.tiler.scratch_view(rows, width, 3, np.float64)
+            buf[...] = np.random.normal(
+                loc=self.mu, scale=self.stddev, size=(rows, width, 3))
+            with image.crop((0, top, width, bottom)) as src:
+                buf += np.asarray(src)
+            np.clip(buf, 0, 255, out=buf)
+            out.paste(Image.fromarray(buf.astype(np.uint8), "RGB"), (0, top))
+        return out, json_dat
+        pass
     pass
 
 
@@ -93,6 +228,8 @@ class BackgroundManip(ImageManip):
     def manip(self, image, json):
         background = Image.open(os.path.join(
             self.background_dir, self.next_background()), "r")
+        # decode now so the file handle is closed, the caller owns the result
+        background.load()
         b_width = background.width
         b_height = background.height
         self.border_size = int(np.abs(np.random.normal(
@@ -134,6 +271,8 @@ class BackgroundManip(ImageManip):
             annot["top"] = box[1]
             annot["width"] = box[2]
             annot["height"] = box[3]
+        for cropped_img in cropped_imgs:
+            cropped_img.close()
 
         return background, json
         pass
@@ -143,6 +282,8 @@ class BackgroundManip(ImageManip):
                  int(float(height) * scale_factor)) for width, height in dims]
         resized_images = [img.resize(
             (int(float(img.width)*scale_factor), int(float(img.height)*scale_factor))) for img in images]
+        for img in images:
+            img.close()
         # dims = [(img.width, img.height) for img in resized_images]
         return (resized_images, dims)
 
@@ -170,9 +311,14 @@ class ManipPipeline(ImageManip):
         pass
 
     def manip(self, image, json):
+        current = image
         for manip in self.manip_pipeline:
-            image, json = manip.manip(image, json)
-        return image, json
+            result, json = manip.manip(current, json)
+            # intermediates belong to the pipeline, the input to the caller
+            if current is not image and result is not current:
+                current.close()
+            current = result
+        return current, json
         pass
 
     def append_chain(self, manip):
@@ -214,6 +360,136 @@ class ContrastManip(ImageManip):
         pass
 
 
+""" Packs grid x grid samples into one frame, the incoming sample
+    fills one cell and the others are drawn from a sample generator
+    such as sample_generator(), pass the generator's ledger to release
+    them through it. Each sample is shrunk by a random factor
+    and placed at a random offset inside its cell, annotations are
+    scaled and shifted with it """
+
+
+class MosaicManip(ImageManip):
+    def __init__(self, samples, grid=2, min_scale=0.7, min_box_size=4, ledger=None):
+        if grid not in (2, 3):
+            raise ValueError("grid must be 2 or 3, got {}".format(grid))
+        self.samples = samples
+        self.grid = grid
+        self.min_scale = min_scale
+        self.min_box_size = min_box_size
+        self.ledger = ledger
+        pass
+
+    def draw_samples(self, count):
+        drawn = []
+        for _ in range(count):
+            try:
+                drawn.append(next(self.samples))
+            except StopIteration:
+                break
+        return drawn
+
+    def manip(self, image, json):
+        width = image.width
+        height = image.height
+        cell_width = width // self.grid
+        cell_height = height // self.grid
+        mosaic = Image.new("RGB", (width, height), (0, 0, 0))
+
+        sources = [(image, json)] + \
+            self.draw_samples(self.grid * self.grid - 1)
+        cells = np.random.permutation(self.grid * self.grid)
+
+        annotations = []
+        categories = []
+        for (src_image, src_json), cell in zip(sources, cells):
+            scale = np.random.uniform(self.min_scale, 1.0)
+            tile_width = int(cell_width * scale)
+            tile_height = int(cell_height * scale)
+            # plain ints so the annotations stay json serializable
+            x_off = int((cell % self.grid) * cell_width +
+                        np.random.randint(0, cell_width - tile_width + 1))
+            y_off = int((cell // self.grid) * cell_height +
+                        np.random.randint(0, cell_height - tile_height + 1))
+
+            tile = src_image.convert("RGB").resize((tile_width, tile_height))
+            mosaic.paste(tile, (x_off, y_off))
+            tile.close()
+
+            scale_x = float(tile_width) / src_image.width
+            scale_y = float(tile_height) / src_image.height
+            for annot, cat in zip(src_json["annotations"], src_json["categories"]):
+                # clip to the tile so boxes never reach into a neighbouring
+                # cell, tiles don't overlap so neither can boxes of two tiles
+                left = max(int(annot["left"] * scale_x), 0)
+                top = max(int(annot["top"] * scale_y), 0)
+                right = min(int((annot["left"] + annot["width"]) * scale_x),
+                            tile_width - 1)
+                bottom = min(int((annot["top"] + annot["height"]) * scale_y),
+                             tile_height - 1)
+                box = (x_off + left, y_off + top, right - left, bottom - top)
+                if box[2] < self.min_box_size or box[3] < self.min_box_size:
+                    continue
+                annotations.append(box + (annot["class_id"],))
+                categories.append(cat)
+
+            if src_image is not image:
+                release_image(src_image, self.ledger)
+
+        json["image_size"] = [{"width": width, "height": height, "depth": 3}]
+        json["categories"] = categories
+        json["annotations"] = [{
+            "class_id": class_id,
+            "left": left,
+            "top": top,
+            "width": box_width,
+            "height": box_height
+        } for left, top, box_width, box_height, class_id in annotations]
+        return mosaic, json
+        pass
+
+
+""" Resizes a frame and its annotations, either to a fixed
+    target_size (width, height) or so the longest side is at most max_side,
+    frames already small enough are left alone """
+
+
+class ResizeManip(ImageManip):
+    def __init__(self, target_size=None, max_side=None, resample=Image.BILINEAR):
+        if (target_size is None) == (max_side is None):
+            raise ValueError("give exactly one of target_size or max_side")
+        self.target_size = target_size
+        self.max_side = max_side
+        self.resample = resample
+        pass
+
+    def output_size(self, width, height):
+        if self.target_size is not None:
+            return tuple(self.target_size)
+        scale = min(1.0, float(self.max_side) / max(width, height))
+        return (max(1, int(round(width * scale))), max(1, int(round(height * scale))))
+
+    def manip(self, image, json):
+        width, height = self.output_size(image.width, image.height)
+        json["image_size"] = [{"width": width, "height": height, "depth": 3}]
+        if (width, height) == image.size:
+            return image, json
+
+        scale_x = float(width) / image.width
+        scale_y = float(height) / image.height
+        for annot in json["annotations"]:
+            left = int(round(annot["left"] * scale_x))
+            top = int(round(annot["top"] * scale_y))
+            right = int(round((annot["left"] + annot["width"]) * scale_x))
+            bottom = int(round((annot["top"] + annot["height"]) * scale_y))
+            annot["left"] = left
+            annot["top"] = top
+            annot["width"] = max(1, right - left)
+            annot["height"] = max(1, bottom - top)
+
+        return image.resize((width, height), self.resample), json
+        pass
+
+
 def file_no_ext(file_name):
     return os.path.splitext(file_name)[0]
 
@@ -255,19 +531,95 @@ def randomly_place_boxes(container_width, container_height, dims):
     pass
 
 
-def sample_generator():
-    file_names = os.listdir(XML_PATH)
-    np.random.shuffle(file_names)
+""" runs load(item) -> (image, json) for every item on a producer
+    thread and yields the samples through a queue of depth entries. With
+    a ledger the producer tracks each image and waits for capacity before
+    loading the next, so a consumer that releases its images keeps the
+    live bytes under the ceiling, one that leaks them gets the ledger's
+    MemoryError here. Samples still queued when the consumer stops are
+    released """
+
 
-    for file_name in file_names:
-        json = file_name_to_json(file_name)
-        img_file_name = file_no_ext(file_name) + ".jpg"
-        img = Image.open(os.path.join(IMAGE_PATH, img_file_name), "r")
+def prefetch_samples(load, items, ledger=None, depth=PREFETCH_DEPTH):
+    samples = queue.Queue(maxsize=depth)
+    stop = threading.Event()
+    done = object()
 
-        yield img, json
+    def put(entry):
+        while not stop.is_set():
+            try:
+                samples.put(entry, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
 
+    def produce():
+        try:
+            for item in items:
+                if ledger is not None:
+                    ledger.wait_for_capacity()
+                if stop.is_set():
+                    return
+                image, json = load(item)
+                if ledger is not None:
+                    ledger.track(image)
+                if not put((image, json)):
+                    release_image(image, ledger)
+                    return
+            put(done)
+        except Exception as e:
+            put(e)
+
+    producer = threading.Thread(target=produce, daemon=True)
+    producer.start()
+    try:
+        while True:
+            entry = samples.get()
+            if entry is done:
+                return
+            if isinstance(entry, Exception):
+                raise entry
+            yield entry
+    finally:
+        stop.set()
+        drain(samples, ledger)
+        # a put that was already waiting can land after the first drain,
+        # the producer gives up within one put timeout once stop is set
+        producer.join(timeout=1.0)
+        drain(samples, ledger)
     pass
 
+
+def drain(samples, ledger=None):
+    while True:
+        try:
+            entry = samples.get_nowait()
+        except queue.Empty:
+            return
+        if isinstance(entry, tuple):
+            release_image(entry[0], ledger)
+
+
+def load_sample(file_name):
+    json = load_annotation(os.path.join(XML_PATH, file_name))
+    img_file_name = file_no_ext(file_name) + ".jpg"
+    img = Image.open(os.path.join(IMAGE_PATH, img_file_name), "r")
+    img.load()
+    return img, json
+
+
+""" yields (image, json) pairs, images are decoded up front on the
+    prefetch thread so no file handle outlives the yield. The consumer
+    owns each image and releases it with release_image(image, ledger).
+    With a ledger, loading waits while it is above its memory ceiling """
+
+
+def sample_generator(ledger=None):
+    file_names = os.listdir(XML_PATH)
+    np.random.shuffle(file_names)
+    return prefetch_samples(load_sample, file_names, ledger)
+
 # jsons = []
 # images = []
 
@@ -285,41 +637,22 @@ def sample_generator():
 # np.random.set_state(state)
 # np.random.shuffle(jsons)
 
-c_manip = ContrastManip(0, 0)
-b_manip = BackgroundManip(BACKGROUND_PATH, circular=True, border_size=30)
-g_manip = GaussianManip(0, 100)
 
-p_manip = ManipPipeline()
-# p_manip.append_chain(c_manip)
-p_manip.append_chain(b_manip)
-p_manip.append_chain(g_manip)
 
-
-
-def run_on_all_images():
+def run_on_all_images(p_manip):
     i = 0
     DEBUG = False
-    for image, json in sample_generator():
-        
+    o_manip = output_manip()
+    ledger = ImageLedger(max_bytes=MEMORY_CEILING_BYTES)
+    for image, json in sample_generator(ledger):
+
         # note that dicts are pass by reference
         a_image, _ = p_manip.manip(image, json)
+        ledger.track(a_image)
 
-        file_name = "{}_{}".format(OUTPUT_PREFIX, i)
-
-        image_path = os.path.join(TEST_PATH, "image", file_name + ".jpg")
-        if DEBUG:
-            draw = ImageDraw.Draw(a_image)
-            for annot in json["annotations"]:
-                draw.rectangle([(annot["left"], annot["top"]),
-                                (annot["left"] + annot["width"],
-                                 annot["top"] + annot["height"])], outline=(0, 255, 0))
-
-        a_image.save(image_path)
-
-        json["file"] = image_path
-        with open(os.path.join(TEST_PATH, "json", file_name + ".json"), "w") as f:
-            dump(json, f, indent=4)
-        image.close()
+        save_sample(a_image, json, i, o_manip, DEBUG)
+        release_image(a_image, ledger)
+        release_image(image, ledger)
         if i % 200 == 199:
             print("Iteration %d" % (i))
         i += 1
@@ -327,14 +660,58 @@ def run_on_all_images():
             break
 
 
+""" encodes an augmented sample and its json into TEST_PATH,
+    output_manip (a ResizeManip) is applied just before encoding """
+
+
+def save_sample(image, json, index, output_manip=None, debug=False):
+    out_image = image
+    if output_manip is not None:
+        out_image, json = output_manip.manip(image, json)
+    # manips like BackgroundManip change the frame size
+    json["image_size"] = [{"width": out_image.width,
+                           "height": out_image.height, "depth": 3}]
+
+    file_name = "{}_{}".format(OUTPUT_PREFIX, index)
+
+    image_path = os.path.join(TEST_PATH, "image", file_name + ".jpg")
+    if debug:
+        draw = ImageDraw.Draw(out_image)
+        for annot in json["annotations"]:
+            draw.rectangle([(annot["left"], annot["top"]),
+                            (annot["left"] + annot["width"],
+                             annot["top"] + annot["height"])], outline=(0, 255, 0))
+
+    out_image.save(image_path, quality=JPEG_QUALITY, subsampling=JPEG_SUBSAMPLING)
+    if out_image is not image:
+        out_image.close()
+
+    json["file"] = image_path
+    with open(os.path.join(TEST_PATH, "json", file_name + ".json"), "w") as f:
+        dump(json, f, indent=4)
+    pass
+
+
+def output_manip():
+    if OUTPUT_SIZE is None and OUTPUT_MAX_SIDE is None:
+        return None
+    return ResizeManip(target_size=OUTPUT_SIZE, max_side=OUTPUT_MAX_SIDE)
+
+
 # run_on_all_images()
 # naive_classification_accuracy(jsons[:7], jsons[:7])
 
-def run_on_all_images_mixed():
+""" each sample is saved as is or through g_manip, p_manip or b_manip
+    picked at random """
+
+
+def run_on_all_images_mixed(g_manip, p_manip, b_manip):
     i = 0
     DEBUG = False
     manip_tally = [0, 0, 0, 0]
-    for image, json in sample_generator():
+    o_manip = output_manip()
+    ledger = ImageLedger(max_bytes=MEMORY_CEILING_BYTES)
+    for image, json in sample_generator(ledger):
         rnd = np.random.rand()
         # note that dicts are pass by reference
         if rnd < .2:
@@ -349,23 +726,11 @@ def run_on_all_images_mixed():
         else:
             a_image, _ = b_manip.manip(image, json)
             manip_tally[3] += 1
+        ledger.track(a_image)
 
-        file_name = "{}_{}".format(OUTPUT_PREFIX, i)
-
-        image_path = os.path.join(TEST_PATH, "image", file_name + ".jpg")
-        if DEBUG:
-            draw = ImageDraw.Draw(a_image)
-            for annot in json["annotations"]:
-                draw.rectangle([(annot["left"], annot["top"]),
-                                (annot["left"] + annot["width"],
-                                 annot["top"] + annot["height"])], outline=(0, 255, 0))
-
-        a_image.save(image_path)
-
-        json["file"] = image_path
-        with open(os.path.join(TEST_PATH, "json", file_name + ".json"), "w") as f:
-            dump(json, f, indent=4)
-        image.close()
+        save_sample(a_image, json, i, o_manip, DEBUG)
+        release_image(a_image, ledger)
+        release_image(image, ledger)
         if i % 200 == 199:
             print("Iteration %d" % (i))
         i += 1
@@ -374,4 +739,17 @@ def run_on_all_images_mixed():
             break    
     pass
 
-run_on_all_images_mixed()
\ No newline at end of file
+
+if __name__ == "__main__":
+    tiler = StripTiler()
+    c_manip = ContrastManip(0, 0)
+    b_manip = BackgroundManip(BACKGROUND_PATH, circular=True, border_size=30)
+    g_manip = GaussianManip(0, 100, tiler=tiler)
+
+    p_manip = ManipPipeline()
+    # p_manip.append_chain(c_manip)
+    # p_manip.append_chain(MosaicManip(sample_generator(), grid=2))
+    p_manip.append_chain(b_manip)
+    p_manip.append_chain(g_manip)
+
+    run_on_all_images_mixed(g_manip, p_manip, b_manip)
\ No newline at end of file
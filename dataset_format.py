@@ -1,15 +1,22 @@
-
 # from xml2json import xml2
-import xmltodict
+import xml.parsers.expat
+import argparse
+import functools
+import hashlib
+import multiprocessing
 import os
 import json
 
 
-if __name__ == "__main__":
-    JSON_PATH = os.path.join(".", "combined_jsons")
-    XML_PATH = os.path.join(".", "combined_xmls")
-    IMAGE_PATH = os.path.join(".", "all_drive")
-    OUT_PATH = JSON_PATH
+JSON_PATH = os.path.join(".", "combined_jsons")
+XML_PATH = os.path.join(".", "combined_xmls")
+IMAGE_PATH = os.path.join(".", "all_drive")
+OUT_PATH = JSON_PATH
+
+
+# kept next to the converted jsons by convert(incremental=True), without
+# a .json suffix so readers of the json dir don't take it for an annotation
+MANIFEST_NAME = ".convert_manifest"
 
 
 CLASSES = ["blue4", "red4"]
@@ -17,6 +24,22 @@ CLASSES_MAP = {"blue4": 0, "red4": 1}
 CLASS_IDS = [0, 1]
 CLASS_IDS_MAP = { 0: "blue4", 1: "red4" }
 
+# element paths the VOC parser keeps, everything else is skipped
+VOC_FILENAME_PATH = ("annotation", "filename")
+VOC_OBJECT_PATH = ("annotation", "object")
+VOC_SIZE_FIELDS = {
+    ("annotation", "size", "width"): "width",
+    ("annotation", "size", "height"): "height",
+    ("annotation", "size", "depth"): "depth",
+}
+VOC_OBJECT_FIELDS = {
+    ("annotation", "object", "name"): "name",
+    ("annotation", "object", "bndbox", "xmin"): "xmin",
+    ("annotation", "object", "bndbox", "ymin"): "ymin",
+    ("annotation", "object", "bndbox", "xmax"): "xmax",
+    ("annotation", "object", "bndbox", "ymax"): "ymax",
+}
+
 def class_name_fix(class_name):
     if class_name == "blue4ww" or class_name == "blue":
         return "blue4"
@@ -29,10 +52,11 @@ def class_id_to_name(cid):
     return CLASS_IDS_MAP[cid]
 
 
-def xml_dict_to_json(xml_dict):
+""" builds the json schema from the raw VOC field strings,
+    objects is a list of dicts with name, xmin, ymin, xmax and ymax """
+def voc_fields_to_json(filename, size_dict, objects):
     j = {}
-    j["file"] = os.path.join(IMAGE_PATH, xml_dict["annotation"]["filename"])
-    size_dict = xml_dict["annotation"]["size"]
+    j["file"] = os.path.join(IMAGE_PATH, filename)
     # why does this need to be a list?
     j["image_size"] = [{
         "width": int(size_dict["width"]),
@@ -41,22 +65,21 @@ def xml_dict_to_json(xml_dict):
     }]
     cats = []
     annotations = []
-    objs = xml_dict["annotation"]["object"]
-    if not isinstance(objs, list):
-        objs = [objs]
-    for o in objs:
-        c_id = CLASSES_MAP[class_name_fix(o["name"])]
+    for o in objects:
+        name = class_name_fix(o["name"])
+        c_id = CLASSES_MAP[name]
         cats.append({
             "class_id": c_id,
-            "name": class_name_fix(o["name"])
+            "name": name
         })
-        bndbox = o["bndbox"]
+        xmin = int(o["xmin"])
+        ymin = int(o["ymin"])
         annotations.append({
             "class_id": c_id,
-            "left": int(bndbox["xmin"]),
-            "top": int(bndbox["ymin"]),
-            "width": int(bndbox["xmax"]) - int(bndbox["xmin"]),
-            "height": int(bndbox["ymax"]) - int(bndbox["ymin"])
+            "left": xmin,
+            "top": ymin,
+            "width": int(o["xmax"]) - xmin,
+            "height": int(o["ymax"]) - ymin
         })
 
     j["categories"] = cats
@@ -64,31 +87,203 @@ def xml_dict_to_json(xml_dict):
     return j
     pass
 
-def file_name_to_dict(file_name, xml_path=None):
+
+def xml_dict_to_json(xml_dict):
+    objs = xml_dict["annotation"]["object"]
+    if not isinstance(objs, list):
+        objs = [objs]
+    objects = [dict(o["bndbox"], name=o["name"]) for o in objs]
+    return voc_fields_to_json(xml_dict["annotation"]["filename"],
+                              xml_dict["annotation"]["size"], objects)
+    pass
+
+
+""" Streams a VOC annotation through expat callbacks and keeps only
+    filename, size and the object names and boxes, skipping the generic
+    nested dict xmltodict builds. data is the file contents as bytes """
+def parse_voc_xml(data):
+    stack = []
+    text = []
+    field = [None]
+    fields = {}
+    size_dict = {}
+    objects = []
+
+    def start(tag, attrs):
+        stack.append(tag)
+        path = tuple(stack)
+        if path == VOC_OBJECT_PATH:
+            objects.append({})
+        if path == VOC_FILENAME_PATH:
+            field[0] = (fields, "filename")
+        elif path in VOC_SIZE_FIELDS:
+            field[0] = (size_dict, VOC_SIZE_FIELDS[path])
+        elif path in VOC_OBJECT_FIELDS:
+            field[0] = (objects[-1], VOC_OBJECT_FIELDS[path])
+        del text[:]
+
+    def chars(data):
+        if field[0] is not None:
+            text.append(data)
+
+    def end(tag):
+        if field[0] is not None:
+            target, key = field[0]
+            target[key] = "".join(text).strip()
+            field[0] = None
+        stack.pop()
+
+    parser = xml.parsers.expat.ParserCreate()
+    parser.buffer_text = True
+    parser.StartElementHandler = start
+    parser.EndElementHandler = end
+    parser.CharacterDataHandler = chars
+    parser.Parse(data, True)
+    return voc_fields_to_json(fields["filename"], size_dict, objects)
+
+
+def file_name_to_dict(file_name, xml_path=XML_PATH):
+    import xmltodict
     with open(os.path.join(xml_path, file_name), "r") as f:
         xml_string = f.read()
         xml_dict = xmltodict.parse(xml_string)
         return xml_dict
     print("Error opening file", file_name)
 
-def file_name_to_json(file_name, xml_path=None):
-    xml_dict = file_name_to_dict(file_name, xml_path=xml_path)
-    return xml_dict_to_json(xml_dict)
+def file_name_to_json(file_name, xml_path=XML_PATH):
+    with open(os.path.join(xml_path, file_name), "rb") as f:
+        return parse_voc_xml(f.read())
 
 
-def convert():
-    print("%s XML DIR" % XML_PATH)
-    print("%s JSON DIR" % JSON_PATH)
-    print("Converting XML Files to JSON")
-    for file_name in os.listdir(XML_PATH):
-        with open(os.path.join(XML_PATH, file_name), "r") as f:
-            xml_string = f.read()
-            xml_dict = xmltodict.parse(xml_string)
-            json_string = xml_dict_to_json(xml_dict)
+""" converts one xml file, returns (file_name, error message or None)
+    so one bad file doesn't stop a batch """
+def convert_file(file_name, xml_path=XML_PATH, out_path=OUT_PATH, compact=False):
+    try:
+        j = file_name_to_json(file_name, xml_path)
         file_no_ext = os.path.splitext(file_name)[0]
-        with open(os.path.join(OUT_PATH, file_no_ext + ".json"), "w") as f:
-            f.write(json.dumps(json_string, indent=4))
-        pass
+        with open(os.path.join(out_path, file_no_ext + ".json"), "w") as f:
+            if compact:
+                f.write(json.dumps(j, separators=(",", ":")))
+            else:
+                f.write(json.dumps(j, indent=4))
+    except Exception as e:
+        return file_name, "{}: {}".format(type(e).__name__, e)
+    return file_name, None
+
+
+def file_digest(path):
+    with open(path, "rb") as f:
+        return hashlib.sha1(f.read()).hexdigest()
+
+
+def load_manifest(out_path):
+    try:
+        with open(os.path.join(out_path, MANIFEST_NAME), "r") as f:
+            return json.load(f)
+    except (IOError, OSError, ValueError):
+        return {}
+
+
+def save_manifest(out_path, manifest):
+    path = os.path.join(out_path, MANIFEST_NAME)
+    with open(path + ".tmp", "w") as f:
+        json.dump(manifest, f, separators=(",", ":"))
+    os.replace(path + ".tmp", path)
+
+
+def json_name(file_name):
+    return os.path.splitext(file_name)[0] + ".json"
+
+
+""" compares xml_path against the manifest of [size, mtime_ns, sha1] per
+    xml. Files whose size and mtime match are skipped without reading them,
+    otherwise the content hash decides. Outputs whose xml is gone are
+    deleted. Returns (file names to convert, updated manifest, changed) """
+def plan_incremental(xml_path, out_path, manifest):
+    outputs = set(os.listdir(out_path))
+    updated = {}
+    to_convert = []
+    changed = False
+    for entry in os.scandir(xml_path):
+        if not entry.is_file():
+            continue
+        st = entry.stat()
+        old = manifest.get(entry.name)
+        output_exists = json_name(entry.name) in outputs
+        if old is not None and old[0] == st.st_size and old[1] == st.st_mtime_ns \
+                and output_exists:
+            updated[entry.name] = old
+            continue
+        digest = file_digest(entry.path)
+        updated[entry.name] = [st.st_size, st.st_mtime_ns, digest]
+        changed = True
+        if old is None or old[2] != digest or not output_exists:
+            to_convert.append(entry.name)
+
+    for file_name in manifest:
+        if file_name not in updated:
+            changed = True
+            if json_name(file_name) in outputs:
+                os.remove(os.path.join(out_path, json_name(file_name)))
+    return to_convert, updated, changed
+
+
+""" converts every xml in xml_path with a pool of workers (None uses
+    every core, 1 converts in process), files are handed out chunksize
+    at a time. With incremental only xmls added or changed since the last
+    incremental run are converted, see plan_incremental.
+    Returns the list of (file_name, error) that failed """
+def convert(xml_path=XML_PATH, out_path=OUT_PATH, workers=None, chunksize=64, compact=False,
+            incremental=False):
+    print("%s XML DIR" % xml_path)
+    print("%s JSON DIR" % out_path)
+    print("Converting XML Files to JSON")
+    if incremental:
+        file_names, manifest, changed = plan_incremental(
+            xml_path, out_path, load_manifest(out_path))
+        print("%d of %d files added or changed" % (len(file_names), len(manifest)))
+    else:
+        file_names = os.listdir(xml_path)
+    task = functools.partial(convert_file, xml_path=xml_path,
+                             out_path=out_path, compact=compact)
+
+    errors = []
+    if workers == 1 or not file_names:
+        pool = None
+        results = map(task, file_names)
+    else:
+        pool = multiprocessing.Pool(workers)
+        results = pool.imap_unordered(task, file_names, chunksize)
+    try:
+        for file_name, error in results:
+            if error is not None:
+                print("Error converting", file_name, error)
+                errors.append((file_name, error))
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+
+    if incremental:
+        # failed files are left out so the next run retries them
+        for file_name, _ in errors:
+            manifest.pop(file_name, None)
+        if changed or errors:
+            save_manifest(out_path, manifest)
+    print("Converted %d files, %d errors" % (len(file_names) - len(errors), len(errors)))
+    return errors
 
 if __name__ == "__main__":
-    convert()
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--xml-path", default=XML_PATH)
+    parser.add_argument("--out-path", default=OUT_PATH)
+    parser.add_argument("--workers", type=int, default=None,
+                        help="worker processes, defaults to one per core")
+    parser.add_argument("--chunksize", type=int, default=64)
+    parser.add_argument("--compact", action="store_true",
+                        help="write json without indentation")
+    parser.add_argument("--incremental", action="store_true",
+                        help="only convert xmls changed since the last incremental run")
+    args = parser.parse_args()
+    convert(args.xml_path, args.out_path, args.workers, args.chunksize, args.compact,
+            args.incremental)
@@ -13,29 +13,36 @@
 # limitations under the License.
 # ==============================================================================
 
-"""Utility functions for creating TFRecord data sets."""
+"""Utility functions for creating TFRecord data sets.
 
-import tensorflow as tf
+Features are built with example_proto, which only needs the protobuf
+runtime, so importing this module does not pull in TensorFlow. The
+messages serialize exactly like tf.train.Feature.
+"""
+
+from xml.etree import ElementTree
+
+import example_proto
 
 
 def int64_feature(value):
-  return tf.train.Feature(int64_list=tf.train.Int64List(value=[value]))
+  return example_proto.Feature(int64_list=example_proto.Int64List(value=[value]))
 
 
 def int64_list_feature(value):
-  return tf.train.Feature(int64_list=tf.train.Int64List(value=value))
+  return example_proto.Feature(int64_list=example_proto.Int64List(value=value))
 
 
 def bytes_feature(value):
-  return tf.train.Feature(bytes_list=tf.train.BytesList(value=[value]))
+  return example_proto.Feature(bytes_list=example_proto.BytesList(value=[value]))
 
 
 def bytes_list_feature(value):
-  return tf.train.Feature(bytes_list=tf.train.BytesList(value=value))
+  return example_proto.Feature(bytes_list=example_proto.BytesList(value=value))
 
 
 def float_list_feature(value):
-  return tf.train.Feature(float_list=tf.train.FloatList(value=value))
+  return example_proto.Feature(float_list=example_proto.FloatList(value=value))
 
 
 def read_examples_list(path):
@@ -50,21 +57,27 @@ def read_examples_list(path):
   would allow us to find files xyz.jpg and xyz.xml (the 3 would be ignored).
 
   Args:
-    path: absolute path to examples list file.
+    path: absolute path to examples list file, remote paths such as
+      gs:// are read through tf.gfile.
 
   Returns:
     list of example identifiers (strings).
   """
-  with tf.gfile.GFile(path) as fid:
-    lines = fid.readlines()
+  if '://' in path:
+    import tensorflow as tf
+    with tf.gfile.GFile(path) as fid:
+      lines = fid.readlines()
+  else:
+    with open(path) as fid:
+      lines = fid.readlines()
   return [line.strip().split(' ')[0] for line in lines]
 
 
 def recursive_parse_xml_to_dict(xml):
-  """Recursively parses XML contents to python dict.
+  """Parses XML contents to python dict.
 
-  We assume that `object` tags are the only ones that can appear
-  multiple times at the same level of a tree.
+  Kept for existing callers, the work is done iteratively by
+  parse_xml_to_dict which returns the same structure.
 
   Args:
     xml: xml tree obtained by parsing XML file contents using lxml.etree
@@ -72,17 +85,59 @@ def recursive_parse_xml_to_dict(xml):
   Returns:
     Python dictionary holding XML contents.
   """
-  if not xml:
+  return parse_xml_to_dict(xml)
+
+
+def parse_xml_to_dict(xml):
+  """Iteratively parses XML contents to python dict.
+
+  Builds the same structure as the old recursive parser in a single
+  pass with an explicit stack: leaves map to their text, other elements to
+  a dict of their children, and `object` tags, the only ones assumed to
+  repeat at the same level, are collected into a list.
+
+  Args:
+    xml: xml element from lxml.etree or xml.etree.ElementTree
+
+  Returns:
+    Python dictionary holding XML contents.
+  """
+  if not len(xml):
     return {xml.tag: xml.text}
-  result = {}
-  for child in xml:
-    child_result = recursive_parse_xml_to_dict(child)
-    if child.tag != 'object':
-      result[child.tag] = child_result[child.tag]
-    else:
-      if child.tag not in result:
-        result[child.tag] = []
-      result[child.tag].append(child_result[child.tag])
-  return {xml.tag: result}
+  root = {}
+  stack = [(xml, root)]
+  while stack:
+    node, result = stack.pop()
+    for child in node:
+      if len(child):
+        value = {}
+        stack.append((child, value))
+      else:
+        value = child.text
+      if child.tag != 'object':
+        result[child.tag] = value
+      elif 'object' in result:
+        result['object'].append(value)
+      else:
+        result['object'] = [value]
+  return {xml.tag: root}
+
+
+def iter_xml_objects(source):
+  """Streams the `object` records of an annotation file.
+
+  Objects are parsed with parse_xml_to_dict as their end tag arrives and
+  cleared right after, so large multi-object files are never held in
+  memory as a whole tree.
 
+  Args:
+    source: path or file object of an XML annotation.
 
+  Yields:
+    One dict per `object` element, as it would appear in the `object` list
+    of parse_xml_to_dict.
+  """
+  for _, elem in ElementTree.iterparse(source, events=('end',)):
+    if elem.tag == 'object':
+      yield parse_xml_to_dict(elem)['object']
+      elem.clear()
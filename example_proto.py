@@ -0,0 +1,102 @@
+""" 
+    tf.train.Example and friends built with only the protobuf runtime
+
+    The descriptors mirror the vendored example.proto and live in a
+    private descriptor pool, so they never clash with TensorFlow's own
+    copies when both are loaded. The wire format is the same, records
+    serialized here parse as tf.train.Example and the other way around
+ """
+
+from google.protobuf import descriptor_pb2, descriptor_pool
+
+try:
+    from google.protobuf.message_factory import GetMessageClass
+except ImportError:
+    # protobuf < 4.21
+    from google.protobuf import message_factory
+
+    def GetMessageClass(descriptor):
+        return message_factory.MessageFactory(descriptor.file.pool).GetPrototype(descriptor)
+
+PACKAGE = "tensorflow"
+
+FieldProto = descriptor_pb2.FieldDescriptorProto
+
+
+def add_field(message, name, number, field_type, label=FieldProto.LABEL_OPTIONAL,
+              type_name=None, packed=False, oneof_index=None):
+    field = message.field.add(name=name, number=number, type=field_type, label=label,
+                              json_name=name)
+    if type_name is not None:
+        field.type_name = ".{}.{}".format(PACKAGE, type_name)
+    if packed:
+        field.options.packed = True
+    if oneof_index is not None:
+        field.oneof_index = oneof_index
+    return field
+
+
+""" map<string, value_type> name = 1, written the way protoc expands it """
+
+
+def add_map_field(message, name, value_type):
+    entry_name = "".join(part.capitalize() for part in name.split("_")) + "Entry"
+    entry = message.nested_type.add(name=entry_name)
+    entry.options.map_entry = True
+    add_field(entry, "key", 1, FieldProto.TYPE_STRING)
+    add_field(entry, "value", 2, FieldProto.TYPE_MESSAGE, type_name=value_type)
+    add_field(message, name, 1, FieldProto.TYPE_MESSAGE, FieldProto.LABEL_REPEATED,
+              type_name="{}.{}".format(message.name, entry_name))
+
+
+def build_file():
+    proto = descriptor_pb2.FileDescriptorProto(
+        name="example.proto", package=PACKAGE, syntax="proto3")
+    repeated = FieldProto.LABEL_REPEATED
+
+    add_field(proto.message_type.add(name="BytesList"), "value", 1,
+              FieldProto.TYPE_BYTES, repeated)
+    add_field(proto.message_type.add(name="FloatList"), "value", 1,
+              FieldProto.TYPE_FLOAT, repeated, packed=True)
+    add_field(proto.message_type.add(name="Int64List"), "value", 1,
+              FieldProto.TYPE_INT64, repeated, packed=True)
+
+    feature = proto.message_type.add(name="Feature")
+    feature.oneof_decl.add(name="kind")
+    add_field(feature, "bytes_list", 1, FieldProto.TYPE_MESSAGE,
+              type_name="BytesList", oneof_index=0)
+    add_field(feature, "float_list", 2, FieldProto.TYPE_MESSAGE,
+              type_name="FloatList", oneof_index=0)
+    add_field(feature, "int64_list", 3, FieldProto.TYPE_MESSAGE,
+              type_name="Int64List", oneof_index=0)
+
+    add_map_field(proto.message_type.add(name="Features"), "feature", "Feature")
+    add_field(proto.message_type.add(name="FeatureList"), "feature", 1,
+              FieldProto.TYPE_MESSAGE, repeated, type_name="Feature")
+    add_map_field(proto.message_type.add(name="FeatureLists"), "feature_list", "FeatureList")
+
+    add_field(proto.message_type.add(name="Example"), "features", 1,
+              FieldProto.TYPE_MESSAGE, type_name="Features")
+    sequence = proto.message_type.add(name="SequenceExample")
+    add_field(sequence, "context", 1, FieldProto.TYPE_MESSAGE, type_name="Features")
+    add_field(sequence, "feature_lists", 2, FieldProto.TYPE_MESSAGE, type_name="FeatureLists")
+    return proto
+
+
+pool = descriptor_pool.DescriptorPool()
+pool.Add(build_file())
+
+
+def message_class(name):
+    return GetMessageClass(pool.FindMessageTypeByName("{}.{}".format(PACKAGE, name)))
+
+
+BytesList = message_class("BytesList")
+FloatList = message_class("FloatList")
+Int64List = message_class("Int64List")
+Feature = message_class("Feature")
+Features = message_class("Features")
+FeatureList = message_class("FeatureList")
+FeatureLists = message_class("FeatureLists")
+Example = message_class("Example")
+SequenceExample = message_class("SequenceExample")
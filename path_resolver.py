@@ -0,0 +1,100 @@
+""" 
+    Resolves the "file" field of annotations onto local image roots
+
+    The committed annotations store windows paths like
+    .\\all_drive\\blue_drive_1010.jpg. Absolute paths that exist are used
+    as they are, otherwise paths are normalized to relative posix form and
+    tried under each root, then by basename under each root.
+    Every unique path is resolved once and existence checks are memoized
+
+    roots default to the IMAGE_ROOTS environment variable (os.pathsep
+    separated) or the current dir and dataset_format.IMAGE_PATH
+ """
+
+import os
+import posixpath
+
+from dataset_format import IMAGE_PATH
+
+
+""" .\\all_drive\\x.jpg -> all_drive/x.jpg, drive letters are dropped """
+
+
+def normalize_path(path):
+    path = path.replace("\\", "/")
+    if len(path) > 1 and path[1] == ":":
+        path = path[2:]
+    path = posixpath.normpath(path).lstrip("/")
+    return "" if path == "." else path
+
+
+def default_roots():
+    env = os.environ.get("IMAGE_ROOTS")
+    if env:
+        return [root for root in env.split(os.pathsep) if root]
+    return [".", IMAGE_PATH]
+
+
+class PathResolver():
+    def __init__(self, roots=None, match_basename=True):
+        self.roots = list(roots) if roots is not None else default_roots()
+        self.match_basename = match_basename
+        self.resolved = {}
+        self.existing = {}
+        pass
+
+    def exists(self, path):
+        found = self.existing.get(path)
+        if found is None:
+            found = self.existing[path] = os.path.isfile(path)
+        return found
+
+    def candidates(self, normalized):
+        parts = normalized.split("/")
+        for root in self.roots:
+            yield os.path.join(root, *parts)
+        if self.match_basename and len(parts) > 1:
+            for root in self.roots:
+                yield os.path.join(root, parts[-1])
+
+    """ returns the local path of an annotation path, None if no root has it """
+
+    def resolve(self, path):
+        try:
+            return self.resolved[path]
+        except KeyError:
+            pass
+        local = None
+        # absolute paths written on this machine, e.g. by save_sample
+        posix = path.replace("\\", "/")
+        for absolute in (path, posix):
+            if os.path.isabs(absolute) and self.exists(absolute):
+                self.resolved[path] = absolute
+                return absolute
+        for candidate in self.candidates(normalize_path(path)):
+            if self.exists(candidate):
+                local = candidate
+                break
+        self.resolved[path] = local
+        return local
+
+    def resolve_many(self, paths):
+        for path in set(paths):
+            self.resolve(path)
+        return [self.resolved[path] for path in paths]
+
+    def resolve_json(self, j):
+        local = self.resolve(j["file"])
+        if local is None:
+            raise IOError("image {} not found under {}".format(j["file"], self.roots))
+        return local
+
+
+shared_resolver = None
+
+
+def get_resolver():
+    global shared_resolver
+    if shared_resolver is None:
+        shared_resolver = PathResolver()
+    return shared_resolver
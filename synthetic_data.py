@@ -0,0 +1,131 @@
+""" 
+    Synthetic frames, backgrounds and annotation dicts shaped like
+    the robot plate dataset, used by the soak run and the benchmarks
+    so they don't need the real images on disk
+ """
+
+import os
+import numpy as np
+from PIL import Image
+from dataset_format import CLASSES, CLASSES_MAP
+from data_augmenting import prefetch_samples
+
+FRAME_WIDTH = 1920
+FRAME_HEIGHT = 1080
+
+
+def synthetic_frame(width=FRAME_WIDTH, height=FRAME_HEIGHT):
+    pixels = np.random.randint(0, 256, size=(height, width, 3), dtype=np.uint8)
+    return Image.fromarray(pixels, "RGB")
+
+
+""" returns a json dict in the xml_dict_to_json schema with num_boxes
+    non overlapping boxes, each box gets its own cell of a square grid """
+
+
+def synthetic_json(num_boxes, width=FRAME_WIDTH, height=FRAME_HEIGHT, file_name="synthetic.jpg"):
+    grid = int(np.ceil(np.sqrt(num_boxes)))
+    cell_width = width // grid
+    cell_height = height // grid
+    cells = np.random.permutation(grid * grid)[:num_boxes]
+
+    categories = []
+    annotations = []
+    for cell in cells:
+        name = CLASSES[np.random.randint(len(CLASSES))]
+        box_width = int(np.random.randint(cell_width // 4, cell_width // 2 + 1))
+        box_height = int(np.random.randint(cell_height // 4, cell_height // 2 + 1))
+        left = int((cell % grid) * cell_width +
+                   np.random.randint(0, cell_width - box_width))
+        top = int((cell // grid) * cell_height +
+                  np.random.randint(0, cell_height - box_height))
+        categories.append({"class_id": CLASSES_MAP[name], "name": name})
+        annotations.append({
+            "class_id": CLASSES_MAP[name],
+            "left": left,
+            "top": top,
+            "width": box_width,
+            "height": box_height
+        })
+
+    return {
+        "file": file_name,
+        "image_size": [{"width": width, "height": height, "depth": 3}],
+        "categories": categories,
+        "annotations": annotations
+    }
+
+
+def write_backgrounds(directory, count, width=FRAME_WIDTH, height=FRAME_HEIGHT):
+    for i in range(count):
+        frame = synthetic_frame(width, height)
+        frame.save(os.path.join(directory, "background_{}.jpg".format(i)))
+        frame.close()
+    pass
+
+
+""" same contract as data_augmenting.sample_generator, frames are
+    copies from a small pool so generating them doesn't dominate """
+
+
+def synthetic_samples(count, width=FRAME_WIDTH, height=FRAME_HEIGHT,
+                      min_boxes=1, max_boxes=30, pool_size=8, ledger=None):
+    pool = [synthetic_frame(width, height) for _ in range(pool_size)]
+
+    def load(i):
+        num_boxes = np.random.randint(min_boxes, max_boxes + 1)
+        return pool[i % pool_size].copy(), synthetic_json(num_boxes, width, height,
+                                                          "synthetic_{}.jpg".format(i))
+    try:
+        for sample in prefetch_samples(load, range(count), ledger):
+            yield sample
+    finally:
+        for frame in pool:
+            frame.close()
+    pass
+
+
+""" renders a json dict back into a labelImg style VOC annotation """
+
+
+def synthetic_voc_xml(json):
+    size = json["image_size"][0]
+    objects = []
+    for cat, annot in zip(json["categories"], json["annotations"]):
+        objects.append(VOC_OBJECT_TEMPLATE.format(
+            name=cat["name"], xmin=annot["left"], ymin=annot["top"],
+            xmax=annot["left"] + annot["width"], ymax=annot["top"] + annot["height"]))
+    return VOC_TEMPLATE.format(
+        filename=os.path.basename(json["file"]), width=size["width"],
+        height=size["height"], depth=size["depth"], objects="".join(objects))
+
+
+VOC_TEMPLATE = """<annotation>
+	<folder>all_drive</folder>
+	<filename>{filename}</filename>
+	<path>C:\\robot\\all_drive\\{filename}</path>
+	<source>
+		<database>Unknown</database>
+	</source>
+	<size>
+		<width>{width}</width>
+		<height>{height}</height>
+		<depth>{depth}</depth>
+	</size>
+	<segmented>0</segmented>
+{objects}</annotation>
+"""
+
+VOC_OBJECT_TEMPLATE = """	<object>
+		<name>{name}</name>
+		<pose>Unspecified</pose>
+		<truncated>0</truncated>
+		<difficult>0</difficult>
+		<bndbox>
+			<xmin>{xmin}</xmin>
+			<ymin>{ymin}</ymin>
+			<xmax>{xmax}</xmax>
+			<ymax>{ymax}</ymax>
+		</bndbox>
+	</object>
+"""
@@ -1,9 +1,23 @@
 
 from dataset_format import *
 import dataset_util
-import tensorflow as tf
+import example_proto
+import tfrecord_index
+import tfrecord_io
+from annotation_loader import load_annotation
+from path_resolver import get_resolver, normalize_path
+import argparse
+import glob
+import hashlib
+import heapq
 import io
+import json
+import multiprocessing
 import numpy as np
+import posixpath
+import re
+import zlib
+from PIL import Image
 
 JSON_PATH = os.path.join(".", "out")
 RECORD_PATH = os.path.join(".", "records")
@@ -11,6 +25,27 @@ RECORD_PATH = os.path.join(".", "records")
 EVAL_RECORD_FILE_NAME = "nabla_robot_plates_eval.record"
 TRAIN_RECORD_FILE_NAME = "nabla_robot_plates_train.record"
 TEST_RECORD_FILE_NAME = "nabla_robot_plates_test.record"
+# (label, record name) of the splits in the order they are filled
+SPLITS = (("Training", TRAIN_RECORD_FILE_NAME),
+          ("Eval", EVAL_RECORD_FILE_NAME),
+          ("Test", TEST_RECORD_FILE_NAME))
+TRAIN_SHARDS = 8
+EVAL_SHARDS = 2
+TEST_SHARDS = 2
+# optional re-encode stage, images whose longest side is above
+# RECORD_MAX_SIDE are resized and stored at RECORD_JPEG_QUALITY
+RECORD_MAX_SIDE = None
+RECORD_JPEG_QUALITY = 90
+# None, "GZIP" or "ZLIB"
+RECORD_COMPRESSION = None
+# {record name: {"shards": [...], "sources": {json: sha1}}} plus the
+# "rejected" duplicates and the "settings" the shards were written with,
+# kept next to the records
+RECORD_MANIFEST_NAME = ".record_manifest.json"
+# drive frames are taken every few frames, frames of the same color at
+# most SEQUENCE_GAP apart are near duplicates and always go to the same split
+SEQUENCE_GAP = 20
+SEQUENCE_NAME = re.compile(r"(blue|red)_drive_(\d+)$")
 
 def get_box_corners(box_dict):
     return {
@@ -20,7 +55,47 @@ def get_box_corners(box_dict):
         "ymax": float(box_dict["top"] + box_dict["height"])
     }
 
-def json_to_record(j):
+""" decodes once, shrinks so the longest side is max_side and re-encodes,
+    returns (jpeg bytes, width, height). JPEGs already within max_side are
+    returned as they are, re-encoding them would only lose quality """
+def reencode_jpeg(encoded, max_side, quality=RECORD_JPEG_QUALITY):
+    with Image.open(io.BytesIO(encoded)) as img:
+        scale = min(1.0, float(max_side) / max(img.size))
+        if scale >= 1.0 and img.format == "JPEG":
+            # only the header has been read so far
+            return encoded, img.width, img.height
+        size = (max(1, int(round(img.width * scale))), max(1, int(round(img.height * scale))))
+        # lets the jpeg decoder skip detail we're about to throw away
+        img.draft("RGB", size)
+        resized = img.convert("RGB")
+        if resized.size != size:
+            resized = resized.resize(size, Image.BILINEAR)
+    out = io.BytesIO()
+    resized.save(out, "JPEG", quality=quality)
+    return out.getvalue(), size[0], size[1]
+
+""" the image bytes behind a json, as they are on disk """
+def read_image_bytes(j, resolver=None):
+    # actual image bytes? refer to dataset_tools/create_pet_tf_record.py
+    # annotation paths are windows style, map them onto the local image roots
+    resolver = resolver if resolver is not None else get_resolver()
+    with open(resolver.resolve_json(j), "rb") as fid:
+        return fid.read()
+
+""" (jpeg bytes, width, height) of the stored image for bytes read by
+    read_image_bytes, re-encoded when max_side is set """
+def encode_image_data(j, encoded, max_side=None, quality=RECORD_JPEG_QUALITY):
+    if max_side is None:
+        image_size = j["image_size"][0]
+        return encoded, image_size["width"], image_size["height"]
+    return reencode_jpeg(encoded, max_side, quality)
+
+""" reads the image bytes of a json, re-encoded when max_side is set.
+    Returns (jpeg bytes, width, height) of the stored image """
+def load_image_data(j, resolver=None, max_side=None, quality=RECORD_JPEG_QUALITY):
+    return encode_image_data(j, read_image_bytes(j, resolver), max_side, quality)
+
+def json_to_record(j, resolver=None, max_side=None, quality=RECORD_JPEG_QUALITY):
     assert(len(j["image_size"]) == 1)
     assert(len(j["categories"]) == len(j["annotations"]))
 
@@ -28,13 +103,12 @@ def json_to_record(j):
     height = image_size["height"]
     width = image_size["width"]
 
-    filename = os.path.basename(j["file"])
+    # the file field is a windows path, basename it the same on every os
+    filename = posixpath.basename(normalize_path(j["file"]))
 
-    # actual image bytes? refer to dataset_tools/create_pet_tf_record.py
-    with tf.gfile.GFile(j["file"], "rb") as fid:
-        encoded_jpg = fid.read()
-        pass
-    encoded_image_data = encoded_jpg
+    # boxes are normalized so they stay valid for the resized image
+    encoded_image_data, record_width, record_height = load_image_data(
+        j, resolver, max_side, quality)
     image_format = b'jpeg'
 
     xmins = []
@@ -56,9 +130,9 @@ def json_to_record(j):
         ymins.append(corners["ymin"] / height)
         ymaxs.append(corners["ymax"] / height)
 
-    tf_example = tf.train.Example(features=tf.train.Features(feature={
-        'image/height': dataset_util.int64_feature(height),
-        'image/width': dataset_util.int64_feature(width),
+    tf_example = example_proto.Example(features=example_proto.Features(feature={
+        'image/height': dataset_util.int64_feature(record_height),
+        'image/width': dataset_util.int64_feature(record_width),
         'image/filename': dataset_util.bytes_feature(filename.encode("utf8")),
         'image/source_id': dataset_util.bytes_feature(filename.encode("utf8")),
         'image/encoded': dataset_util.bytes_feature(encoded_image_data),
@@ -74,76 +148,551 @@ def json_to_record(j):
     return tf_example
     pass
 
-def convert_files_to_record(train_size=5000, eval_size=250):
-    assert(len(os.listdir(XML_PATH)) >= train_size + eval_size)
-    file_names = os.listdir(XML_PATH)
-    arrangement = np.arange(0, len(file_names), 1, dtype="int")
-    np.random.shuffle(arrangement)
-    train_indices = arrangement[:train_size]
-    eval_indices = arrangement[train_size:train_size + eval_size]
-
-    print("Creating n = {} Training Record".format(train_size))
-    writer = tf.python_io.TFRecordWriter(os.path.join(RECORD_PATH, TRAIN_RECORD_FILE_NAME))
-    for idx in train_indices:
-        file_name = file_names[idx]
-        j = file_name_to_json(file_name)
-        tf_example = json_to_record(j)
-        writer.write(tf_example.SerializeToString())
-    writer.close()
+# class_id -> label map text, encoded once
+CLASS_TEXTS = {cid: name.encode("utf8") for cid, name in CLASS_IDS_MAP.items()}
+
+""" json_to_record without the per sample allocations, one Example is
+    built up front and its repeated fields are cleared and refilled for
+    every sample, boxes are normalized with numpy over all annotations at
+    once. The Example returned by build is overwritten by the next call,
+    serialize it (or CopyFrom it) before building another """
+class ExampleBuilder():
+    def __init__(self, resolver=None, max_side=None, quality=RECORD_JPEG_QUALITY):
+        self.resolver = resolver if resolver is not None else get_resolver()
+        self.max_side = max_side
+        self.quality = quality
+        self.example = example_proto.Example()
+        feature = self.example.features.feature
+        # handles into the map entries, they stay valid while the Example lives
+        self.height = feature['image/height'].int64_list.value
+        self.width = feature['image/width'].int64_list.value
+        self.filename = feature['image/filename'].bytes_list.value
+        self.source_id = feature['image/source_id'].bytes_list.value
+        self.encoded = feature['image/encoded'].bytes_list.value
+        feature['image/format'].bytes_list.value.append(b'jpeg')
+        self.xmin = feature['image/object/bbox/xmin'].float_list.value
+        self.xmax = feature['image/object/bbox/xmax'].float_list.value
+        self.ymin = feature['image/object/bbox/ymin'].float_list.value
+        self.ymax = feature['image/object/bbox/ymax'].float_list.value
+        self.text = feature['image/object/class/text'].bytes_list.value
+        self.label = feature['image/object/class/label'].int64_list.value
+        self.fields = (self.height, self.width, self.filename, self.source_id,
+                       self.encoded, self.xmin, self.xmax, self.ymin, self.ymax,
+                       self.text, self.label)
+        pass
+
+    """ refills the Example from a json and its already loaded image """
+    def fill(self, j, encoded, record_width, record_height):
+        assert(len(j["image_size"]) == 1)
+        assert(len(j["categories"]) == len(j["annotations"]))
+        image_size = j["image_size"][0]
+        annotations = j["annotations"]
+
+        boxes = np.array([(a["left"], a["top"], a["width"], a["height"]) for a in annotations],
+                         dtype=np.float64).reshape(-1, 4)
+        class_ids = [a["class_id"] for a in annotations]
+        # boxes are normalized so they stay valid for the resized image
+        boxes[:, 2:] += boxes[:, :2]
+        boxes[:, 0::2] /= image_size["width"]
+        boxes[:, 1::2] /= image_size["height"]
+
+        for field in self.fields:
+            del field[:]
+        filename = posixpath.basename(normalize_path(j["file"])).encode("utf8")
+        self.height.append(record_height)
+        self.width.append(record_width)
+        self.filename.append(filename)
+        self.source_id.append(filename)
+        self.encoded.append(encoded)
+        self.xmin.extend(boxes[:, 0].tolist())
+        self.ymin.extend(boxes[:, 1].tolist())
+        self.xmax.extend(boxes[:, 2].tolist())
+        self.ymax.extend(boxes[:, 3].tolist())
+        self.text.extend([CLASS_TEXTS[cid] for cid in class_ids])
+        # class_ids are indexed by 1 for tensorflow
+        self.label.extend([cid + 1 for cid in class_ids])
+        return self.example
+
+    def build(self, j):
+        return self.fill(j, *load_image_data(j, self.resolver, self.max_side, self.quality))
+
+    def serialize(self, j):
+        return self.build(j).SerializeToString()
+    pass
+
+""" tfrecord_io writes the same bytes as tf.python_io.TFRecordWriter
+    without importing TensorFlow in every worker """
+def record_writer(path, compression=RECORD_COMPRESSION):
+    return tfrecord_io.TFRecordWriter(path, compression)
+
+""" records are split into shards named like
+    nabla_robot_plates_train.record-00003-of-00008 so the input readers
+    can glob them and read in parallel """
+def shard_file_name(name, shard, num_shards):
+    return "{}-{:05d}-of-{:05d}".format(name, shard, num_shards)
+
+def shard_pattern(name):
+    return "{}-?????-of-?????".format(name)
+
+""" annotation jsons of a directory, dotfiles are caches and manifests """
+def list_json_files(path=None):
+    return [f for f in os.listdir(path or JSON_PATH) if f.endswith(".json") and not f.startswith(".")]
+
+def load_record_manifest(record_path=RECORD_PATH):
+    try:
+        with open(os.path.join(record_path, RECORD_MANIFEST_NAME), "r") as f:
+            return json.load(f)
+    except (IOError, OSError, ValueError):
+        return {}
+
+def save_record_manifest(manifest, record_path=RECORD_PATH):
+    path = os.path.join(record_path, RECORD_MANIFEST_NAME)
+    with open(path + ".tmp", "w") as f:
+        json.dump(manifest, f, separators=(",", ":"))
+    os.replace(path + ".tmp", path)
+
+""" tf_record_input_reader block for robot_plate.config reading the
+    shards of a record name """
+def input_reader_snippet(name, compression=RECORD_COMPRESSION):
+    lines = ["  tf_record_input_reader {"]
+    if tfrecord_io.compression_type(compression) is not None:
+        # input_reader.proto has no compression field, the object detection
+        # dataset_builder has to open the files with a matching compression_type
+        lines.append("    # {} compressed, build tf.data.TFRecordDataset with "
+                     "compression_type=\"{}\"".format(compression.upper(), compression.upper()))
+    lines.append("    input_path: \"{}\"".format(
+        posixpath.join(RECORD_PATH.replace(os.sep, "/"), shard_pattern(name))))
+    lines.append("  }")
+    return "\n".join(lines)
+
+""" splits samples into num_shards lists of sample indices, "count"
+    deals them out round robin and "size" balances the total image bytes
+    per shard. A sample is an annotation path, or for "size" its already
+    loaded json dict """
+def assign_shards(samples, num_shards, balance="count"):
+    shards = [[] for _ in range(num_shards)]
+    if balance == "count":
+        for i in range(len(samples)):
+            shards[i % num_shards].append(i)
+        return shards
+    if balance != "size":
+        raise ValueError("balance must be count or size, got {}".format(balance))
 
-    print("Creating n = {} Eval Record".format(eval_size))
-    writer = tf.python_io.TFRecordWriter(os.path.join(RECORD_PATH, EVAL_RECORD_FILE_NAME))
-    for idx in eval_indices:
-        file_name = file_names[idx]
-        j = file_name_to_json(file_name)
-        tf_example = json_to_record(j)
-        writer.write(tf_example.SerializeToString())
+    resolver = get_resolver()
+    sizes = []
+    for sample in samples:
+        image_path = resolver.resolve(sample["file"])
+        sizes.append(os.path.getsize(image_path) if image_path is not None else 0)
+    # largest first into the lightest shard
+    loads = [(0, shard) for shard in range(num_shards)]
+    for idx in np.argsort(sizes)[::-1]:
+        load, shard = heapq.heappop(loads)
+        shards[shard].append(int(idx))
+        heapq.heappush(loads, (load + sizes[idx], shard))
+    return shards
+
+""" worker task, writes one shard. A sample is an annotation path or its
+    loaded json, each image is read once and hashed and encoded from the
+    same bytes. claims maps a sha1 to the json (or record) that holds the
+    image and is shared by all writers of a run, a sample whose image is
+    claimed by another is a duplicate and is not written. Which of two
+    copies written at the same time wins is up to the workers.
+    Returns (shard path, [(json name, sha1, written)]) """
+def write_shard(task):
+    shard_path, names, samples, max_side, quality, compression, claims = task
+    writer = record_writer(shard_path, compression)
+    builder = ExampleBuilder(max_side=max_side, quality=quality)
+    sources = []
+    for name, sample in zip(names, samples):
+        j = load_annotation(sample) if isinstance(sample, str) else sample
+        encoded = read_image_bytes(j, builder.resolver)
+        digest = hashlib.sha1(encoded).hexdigest()
+        written = claims.setdefault(digest, name) == name
+        if written:
+            image = encode_image_data(j, encoded, max_side, quality)
+            writer.write(builder.fill(j, *image).SerializeToString())
+        sources.append((name, digest, written))
     writer.close()
+    return shard_path, sources
+
+""" one pass over a shuffled manifest of annotation paths, each sample is
+    routed to the split it falls in and to a shard of that split, then all
+    shards of all splits are written by one pool of workers.
+    A manifest entry is a path or a (path, json) pair the caller already
+    loaded, the json is handed to the writer as is so no file is read twice.
+    splits is a list of (label, record name, sample count, shard count)
+    taken from the front of the manifest in order. max_side and quality
+    turn on the re-encode stage of json_to_record, compression is passed
+    to the writers. first_shards maps a record name to the number of
+    shards it already has, appended shards are numbered after them and
+    named -of- the new total, so shard_pattern still globs the whole set.
+    known maps the sha1 of images already in the records to their record
+    name, those and repeats within the manifest are skipped.
+    Returns ({record name: [shard paths]},
+             {record name: [(json name, sha1, written)]}) """
+def write_split_records(manifest, splits, workers=None, balance="count",
+                        max_side=RECORD_MAX_SIDE, quality=RECORD_JPEG_QUALITY,
+                        compression=RECORD_COMPRESSION, first_shards=None, known=None):
+    routed = [[] for _ in splits]
+    bounds = np.cumsum([split[2] for split in splits])
+    for idx, sample in enumerate(manifest):
+        split = np.searchsorted(bounds, idx, side="right")
+        if split == len(splits):
+            break
+        path, j = sample if isinstance(sample, tuple) else (sample, None)
+        if j is None and balance == "size":
+            # size balancing needs the json in the parent, load it only once
+            j = load_annotation(path)
+        routed[split].append((path, j))
+
+    if workers == 1:
+        manager = None
+        claims = {}
+    else:
+        # one claim per image across every writer process
+        manager = multiprocessing.Manager()
+        claims = manager.dict()
+    claims.update(known or {})
+
+    tasks = []
+    shard_paths = {}
+    for (label, name, _, num_shards), samples in zip(splits, routed):
+        if not samples:
+            continue
+        print("Creating n = {} {} Record".format(len(samples), label))
+        num_shards = max(1, min(num_shards, len(samples)))
+        first = (first_shards or {}).get(name, 0)
+        shard_paths[name] = []
+        loaded = [path if j is None else j for path, j in samples]
+        for i, shard in enumerate(assign_shards(loaded, num_shards, balance)):
+            shard_path = os.path.join(RECORD_PATH, shard_file_name(
+                name, first + i, first + num_shards))
+            shard_paths[name].append(shard_path)
+            tasks.append((shard_path, [os.path.basename(samples[idx][0]) for idx in shard],
+                          [loaded[idx] for idx in shard], max_side, quality, compression, claims))
+
+    split_of = {os.path.basename(path): name for name, paths in shard_paths.items()
+                for path in paths}
+    sources = {name: [] for name in shard_paths}
+    if workers == 1 or len(tasks) <= 1:
+        pool = None
+        results = map(write_shard, tasks)
+    else:
+        pool = multiprocessing.Pool(min(workers or len(tasks), len(tasks)))
+        results = pool.imap_unordered(write_shard, tasks)
+    try:
+        for done, (shard_path, shard_sources) in enumerate(results, 1):
+            sources[split_of[os.path.basename(shard_path)]].extend(shard_sources)
+            print("[{}/{}] Wrote {} records to {}".format(
+                done, len(tasks), sum(1 for source in shard_sources if source[2]), shard_path))
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+        if manager is not None:
+            manager.shutdown()
+
+    for label, name, _, _ in splits:
+        print("{}: {} records in {} shards".format(
+            label, sum(1 for source in sources.get(name, []) if source[2]),
+            len(shard_paths.get(name, []))))
+    return shard_paths, sources
+
+def convert_files_to_record(train_size=5000, eval_size=250, workers=None):
+    file_names = os.listdir(XML_PATH)
+    assert(len(file_names) >= train_size + eval_size)
+    np.random.shuffle(file_names)
+
+    write_split_records([os.path.join(XML_PATH, file_name) for file_name in file_names], [
+        ("Training", TRAIN_RECORD_FILE_NAME, train_size, TRAIN_SHARDS),
+        ("Eval", EVAL_RECORD_FILE_NAME, eval_size, EVAL_SHARDS),
+    ], workers)
     pass
 
-def convert_json_files_to_record(train_size=5000, eval_size=250, test_size=250):
-    assert(len(os.listdir(JSON_PATH)) >= train_size + eval_size + test_size)
-    file_names = os.listdir(JSON_PATH)
-
-    arrangement = np.arange(0, len(file_names), 1, dtype="int")
-    np.random.shuffle(arrangement)
-
-    train_indices = arrangement[:train_size]
-    eval_indices = arrangement[train_size:train_size + eval_size]
-    test_indices = arrangement[train_size + eval_size:test_size + train_size + eval_size]
-
-    if train_size > 0:
-        print("Creating n = {} Training Record".format(train_size))
-        writer = tf.python_io.TFRecordWriter(os.path.join(RECORD_PATH, TRAIN_RECORD_FILE_NAME))
-        for idx in train_indices:
-            file_name = file_names[idx]
-            j = json.load(open(os.path.join(JSON_PATH, file_name)))
-            tf_example = json_to_record(j)
-            writer.write(tf_example.SerializeToString())
-        writer.close()
-    
-    if eval_size > 0:
-        print("Creating n = {} Eval Record".format(eval_size))
-        writer = tf.python_io.TFRecordWriter(os.path.join(RECORD_PATH, EVAL_RECORD_FILE_NAME))
-        for idx in eval_indices:
-            file_name = file_names[idx]
-            j = json.load(open(os.path.join(JSON_PATH, file_name)))
-            tf_example = json_to_record(j)
-            writer.write(tf_example.SerializeToString())
-            pass
-        writer.close()
-
-    if test_size > 0:
-        print("Creating n = {} Test Record".format(test_size))
-        writer = tf.python_io.TFRecordWriter(os.path.join(RECORD_PATH, TEST_RECORD_FILE_NAME))
-        for idx in test_indices:
-            file_name = file_names[idx]
-            j = json.load(open(os.path.join(JSON_PATH, file_name)))
-            tf_example = json_to_record(j)
-            writer.write(tf_example.SerializeToString())
-            pass
-        writer.close()
+""" drive sequence group of each json file name. The frames of a color are
+    sorted and a sequence runs on while the next frame is at most
+    SEQUENCE_GAP after the last, blue_drive_1010, 1020 and 1045 are the
+    groups blue_drive_1010, blue_drive_1010 and blue_drive_1045. Other
+    names, augmented samples, are a group of their own """
+def sequence_groups(file_names):
+    groups = [os.path.splitext(os.path.basename(f))[0] for f in file_names]
+    frames = {}
+    for i, stem in enumerate(groups):
+        match = SEQUENCE_NAME.match(stem)
+        if match is not None:
+            frames.setdefault(match.group(1), []).append((int(match.group(2)), i))
+    for color, indexed in frames.items():
+        indexed.sort()
+        start = last = indexed[0][0]
+        for frame, i in indexed:
+            if frame - last > SEQUENCE_GAP:
+                start = frame
+            groups[i] = "{}_drive_{}".format(color, start)
+            last = frame
+    return groups
+
+""" bit mask of the classes present in a json, the stratum of a sample """
+def class_mask(j):
+    mask = 0
+    for annot in j["annotations"]:
+        mask |= 1 << annot["class_id"]
+    return mask
+
+""" deterministic split of samples in the given fractions, whole groups go
+    to one split. The groups of each class mask stratum are taken in order
+    of crc32 of their key, each goes to the smaller split furthest below
+    its share of the stratum when it fits in it by at least half, the
+    largest split takes the rest. Every split gets its share of every
+    stratum up to a small group. Returns (split index, position) per
+    sample, inside a split the position runs evenly over every stratum so
+    taking the lowest positions keeps the class balance """
+def assign_splits(groups, masks, fractions):
+    if len(groups) == 0:
+        return np.zeros(0, dtype=np.int64), np.zeros(0)
+    keys, inverse = np.unique(np.asarray(groups), return_inverse=True)
+    group_hash = np.array([zlib.crc32(key.encode("utf8")) for key in keys.tolist()],
+                          dtype=np.int64)
+    group_mask = np.zeros(len(keys), dtype=np.int64)
+    np.bitwise_or.at(group_mask, inverse, np.asarray(masks, dtype=np.int64))
+    group_size = np.bincount(inverse, minlength=len(keys))
+    fractions = np.asarray(fractions, dtype=np.float64) / np.sum(fractions)
+    sink = int(np.argmax(fractions))
+
+    split = np.full(len(keys), sink, dtype=np.int64)
+    for mask in np.unique(group_mask):
+        stratum = np.flatnonzero(group_mask == mask)
+        # hash order, the key breaks crc collisions
+        stratum = stratum[np.lexsort((stratum, group_hash[stratum]))]
+        room = fractions * group_size[stratum].sum()
+        room[sink] = 0
+        for g in stratum:
+            k = int(np.argmax(room))
+            if room[k] >= group_size[g] / 2.0:
+                split[g] = k
+                room[k] -= group_size[g]
+
+    order = np.lexsort((np.arange(len(keys)), group_hash, group_mask, split))
+    position = np.empty(len(keys))
+    sizes = group_size[order]
+    cell = split[order] * (int(group_mask.max()) + 1) + group_mask[order]
+    ends = np.cumsum(sizes)
+    first = np.r_[0, np.flatnonzero(np.diff(cell)) + 1]
+    cell_of = np.cumsum(np.r_[0, np.diff(cell) != 0])
+    cell_start = (ends - sizes)[first][cell_of]
+    cell_total = np.add.reduceat(sizes, first)[cell_of]
+    # a group sits at the middle of the samples it spans in its stratum
+    position[order] = (ends - sizes - cell_start + sizes / 2.0) / cell_total
+    return split[inverse], position[inverse]
+
+""" assign_splits over annotation paths, the candidates of each split as
+    (path, json) pairs ordered by position, so the front of a list keeps
+    the class balance. With counts, a split the assignment left short of
+    its count takes whole groups no other split reaches with its count,
+    lowest positions first. The jsons are loaded here once and handed on
+    to the shard writers """
+def select_split_sources(paths, fractions, counts=None):
+    jsons = [load_annotation(path) for path in paths]
+    groups = sequence_groups(paths)
+    split, position = assign_splits(groups, [class_mask(j) for j in jsons], fractions)
+    members = []
+    for k in range(len(fractions)):
+        idx = np.flatnonzero(split == k)
+        members.append(idx[np.argsort(position[idx], kind="stable")].tolist())
+
+    if counts is not None:
+        used = set(groups[i] for k, idx in enumerate(members) for i in idx[:counts[k]])
+        spare = sorted((position[i], groups[i], i) for k, idx in enumerate(members)
+                       for i in idx[counts[k]:] if groups[i] not in used)
+        for k, idx in enumerate(members):
+            while len(idx) < counts[k] and spare:
+                group = spare[0][1]
+                moved = [i for _, g, i in spare if g == group]
+                spare = [entry for entry in spare if entry[1] != group]
+                for i in moved:
+                    members[split[i]].remove(i)
+                idx.extend(moved)
+    return [[(paths[i], jsons[i]) for i in idx] for idx in members]
+
+""" the writer settings stored in the manifest, appended shards must be
+    written like the existing ones """
+def record_settings(max_side=RECORD_MAX_SIDE, quality=RECORD_JPEG_QUALITY,
+                    compression=RECORD_COMPRESSION):
+    return {"max_side": max_side, "quality": quality,
+            "compression": tfrecord_io.compression_type(compression)}
+
+""" the record name -> sha1 index of every source already written """
+def known_sources(manifest):
+    known = {}
+    for name, split in manifest.get("splits", {}).items():
+        for digest in split["sources"].values():
+            known[digest] = name
+    return known
+
+""" writes up to counts[k] of the candidates of each split, in order, as
+    new shards of the (label, record name) splits and records them in the
+    manifest. The writers reject images that are in the records already
+    or repeated, a split short of its count because of that takes its
+    next candidates in another round of shards.
+    Returns the number of samples written per split """
+def write_split_sources(manifest, splits, candidates, counts, num_shards, workers=None,
+                        balance="count", max_side=RECORD_MAX_SIDE,
+                        quality=RECORD_JPEG_QUALITY, compression=RECORD_COMPRESSION):
+    entries = manifest.setdefault("splits", {})
+    rejected = manifest.setdefault("rejected", {})
+    for _, name in splits:
+        entries.setdefault(name, {"shards": [], "sources": {}})
+    written = [0] * len(splits)
+    taken = [0] * len(splits)
+    while True:
+        batch = []
+        round_splits = []
+        for k, (label, name) in enumerate(splits):
+            want = min(counts[k] - written[k], len(candidates[k]) - taken[k])
+            shards = num_shards[k]
+            if taken[k]:
+                # refills keep the records per shard of the first round
+                shards = int(np.ceil(want * num_shards[k] / float(max(1, counts[k]))))
+            batch.extend(candidates[k][taken[k]:taken[k] + want])
+            round_splits.append((label, name, want, max(1, shards)))
+            taken[k] += want
+        if not batch:
+            return written
+        first_shards = {name: len(entries[name]["shards"]) for _, name in splits}
+        shard_paths, sources = write_split_records(
+            batch, round_splits, workers, balance, max_side, quality, compression,
+            first_shards, known_sources(manifest))
+        for k, (_, name) in enumerate(splits):
+            entries[name]["shards"].extend(os.path.basename(path)
+                                           for path in shard_paths.get(name, []))
+            for source_name, digest, ok in sources.get(name, []):
+                if ok:
+                    entries[name]["sources"][source_name] = digest
+                    written[k] += 1
+                else:
+                    rejected[source_name] = digest
+
+def convert_json_files_to_record(train_size=5000, eval_size=250, test_size=250,
+                                 num_shards=None, workers=None, balance="count",
+                                 max_side=RECORD_MAX_SIDE, quality=RECORD_JPEG_QUALITY,
+                                 compression=RECORD_COMPRESSION):
+    # sorted so the split only depends on the set of files
+    file_names = sorted(list_json_files())
+    sizes = (train_size, eval_size, test_size)
+    assert(len(file_names) >= sum(sizes))
+    # (train, eval, test) shard counts
+    num_shards = num_shards or (TRAIN_SHARDS, EVAL_SHARDS, TEST_SHARDS)
+
+    # whole drive sequences per split, and the same image under two names
+    # must not land in two splits either
+    candidates = select_split_sources(
+        [os.path.join(JSON_PATH, file_name) for file_name in file_names], sizes, sizes)
+    # a rebuild replaces the whole set, stale or appended shards would
+    # still match the input glob, and their index sidecars would point
+    # into the new files
+    for _, name in SPLITS:
+        for stale in glob.glob(os.path.join(RECORD_PATH, shard_pattern(name))):
+            for path in (stale, tfrecord_index.index_path(stale), tfrecord_index.ids_path(stale)):
+                if os.path.exists(path):
+                    os.remove(path)
+    manifest = {"settings": record_settings(max_side, quality, compression)}
+    written = write_split_sources(manifest, SPLITS, candidates, sizes, num_shards, workers,
+                                  balance, max_side, quality, compression)
+    if manifest["rejected"]:
+        print("Skipped {} duplicate images".format(len(manifest["rejected"])))
+    for (label, _), size, count in zip(SPLITS, sizes, written):
+        if count < size:
+            # only when the files hold too few distinct images
+            print("{}: only {} of {} samples".format(label, count, size))
+    save_record_manifest(manifest)
+    pass
+
+""" writes only the jsons the record manifest has not seen yet as extra
+    shards of each split. New frames of a drive sequence that is already
+    in a split join that split, new sequences are assigned like a full
+    conversion in the proportions of the existing set. Each split gets
+    as many new shards as keeps its records per shard, images already in
+    any split are rejected. max_side, quality and compression default to
+    the settings of the manifest, other values raise a ValueError """
+def append_json_files_to_record(workers=None, balance="count",
+                                max_side=None, quality=None, compression=None):
+    manifest = load_record_manifest()
+    entries = manifest.get("splits", {})
+    if not entries:
+        raise IOError("no {} in {}, run a full conversion first".format(
+            RECORD_MANIFEST_NAME, RECORD_PATH))
+    settings = manifest.setdefault("settings", record_settings())
+    given = {"max_side": max_side, "quality": quality}
+    if compression is not None:
+        # "NONE" is a setting too, only None means not given
+        given["compression"] = tfrecord_io.compression_type(compression) or "NONE"
+    for key, value in given.items():
+        if value is not None and value != (settings[key] or "NONE"):
+            raise ValueError("the records were written with {}={}, got {}".format(
+                key, settings[key], value))
+    seen = set(manifest.get("rejected", {}))
+    for entry in entries.values():
+        seen.update(entry["sources"])
+    file_names = sorted(file_name for file_name in list_json_files() if file_name not in seen)
+    existing = [(label, name) for label, name in SPLITS if name in entries]
+    written = [(k, file_name) for k, (_, name) in enumerate(existing)
+               for file_name in entries[name]["sources"]]
+    # sequences are found over the whole set, a new frame close to a
+    # written one is part of its sequence
+    groups = sequence_groups([file_name for _, file_name in written] + file_names)
+    members = {}
+    for (k, _), group in zip(written, groups):
+        members.setdefault(group, []).append(k)
+    # a new frame can bridge two sequences, it joins the split holding more of them
+    group_split = {group: int(np.argmax(np.bincount(ks))) for group, ks in members.items()}
+
+    paths = [os.path.join(JSON_PATH, file_name) for file_name in file_names]
+    new_groups = groups[len(written):]
+    fractions = [len(entries[name]["sources"]) for _, name in existing]
+    fresh = [path for path, group in zip(paths, new_groups) if group not in group_split]
+    candidates = select_split_sources(fresh, fractions)
+    # frames of known sequences, in the split of their sequence
+    for path, group in zip(paths, new_groups):
+        if group in group_split:
+            candidates[group_split[group]].append((path, load_annotation(path)))
+
+    num_shards = []
+    for (_, name), split_candidates in zip(existing, candidates):
+        per_shard = max(1.0, float(len(entries[name]["sources"])) / max(1, len(entries[name]["shards"])))
+        num_shards.append(max(1, int(np.ceil(len(split_candidates) / per_shard))))
+    rejected = len(manifest.get("rejected", {}))
+    written = write_split_sources(manifest, existing, candidates,
+                                  [len(split_candidates) for split_candidates in candidates],
+                                  num_shards, workers, balance, settings["max_side"],
+                                  settings["quality"], settings["compression"])
+    print("{} new samples, {} rejected as duplicates".format(
+        sum(written), len(manifest["rejected"]) - rejected))
+    save_record_manifest(manifest)
     pass
 
 if __name__ == "__main__":
-    convert_json_files_to_record()
\ No newline at end of file
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--shards", type=int, nargs=3, default=None,
+                        metavar=("TRAIN", "EVAL", "TEST"))
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--balance", choices=("count", "size"), default="count")
+    # left unset they are the module defaults, or the manifest's on --append
+    parser.add_argument("--max-side", type=int, default=None,
+                        help="re-encode images so their longest side is at most this")
+    parser.add_argument("--quality", type=int, default=None)
+    parser.add_argument("--compression", choices=("NONE", "GZIP", "ZLIB"), default=None)
+    parser.add_argument("--append", action="store_true",
+                        help="only write jsons missing from the record manifest, as extra shards")
+    args = parser.parse_args()
+    if args.append:
+        append_json_files_to_record(workers=args.workers, balance=args.balance,
+                                    max_side=args.max_side, quality=args.quality,
+                                    compression=args.compression)
+    else:
+        convert_json_files_to_record(
+            num_shards=args.shards, workers=args.workers, balance=args.balance,
+            max_side=args.max_side if args.max_side is not None else RECORD_MAX_SIDE,
+            quality=args.quality if args.quality is not None else RECORD_JPEG_QUALITY,
+            compression=args.compression if args.compression is not None else RECORD_COMPRESSION)
+    compression = load_record_manifest()["settings"]["compression"]
+    for name in (TRAIN_RECORD_FILE_NAME, EVAL_RECORD_FILE_NAME):
+        print(input_reader_snippet(name, compression))
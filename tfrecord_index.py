@@ -0,0 +1,207 @@
+""" 
+    Random access into TFRecord files
+
+    index_record scans a record file once, reading only the frame headers,
+    and writes a <record>.idx.npy sidecar of (data offset, length) pairs,
+    headed by the (size, mtime_ns) of the record file it was built from,
+    plus <record>.ids.npy with each record's image/source_id. RecordIndex
+    mmaps the record file and fetches any record by position or source id,
+    a sidecar that no longer matches its record file is rebuilt first.
+    Offsets only exist in uncompressed files, GZIP/ZLIB shards are refused
+
+    python tfrecord_index.py index records/nabla_robot_plates_eval.record-*
+    python tfrecord_index.py show records/nabla_robot_plates_eval.record-00000-of-00002 12
+ """
+
+import argparse
+import mmap
+import os
+
+import numpy as np
+
+import example_proto
+from tfrecord_io import CRC, LENGTH, CorruptRecordError, masked_crc32c
+
+HEADER_SIZE = LENGTH.size + CRC.size
+
+
+def index_path(record_path):
+    return record_path + ".idx.npy"
+
+
+def ids_path(record_path):
+    return record_path + ".ids.npy"
+
+
+def source_id(record):
+    example = example_proto.Example()
+    example.ParseFromString(record)
+    values = example.features.feature["image/source_id"].bytes_list.value
+    return values[0].decode("utf8") if values else ""
+
+
+""" None for an uncompressed record file, "GZIP" or "ZLIB" when the file
+    starts like a compressed stream instead of a record header with a
+    valid length crc """
+
+
+def detect_compression(record_path):
+    with open(record_path, "rb") as f:
+        head = f.read(HEADER_SIZE)
+    if len(head) == HEADER_SIZE and \
+            CRC.unpack(head[LENGTH.size:])[0] == masked_crc32c(head[:LENGTH.size]):
+        return None
+    if head[:2] == b"\x1f\x8b":
+        return "GZIP"
+    if len(head) >= 2 and head[0] & 0x0F == 8 and (head[0] * 256 + head[1]) % 31 == 0:
+        return "ZLIB"
+    return None
+
+
+""" returns an (n, 2) int64 array of (data offset, length), with
+    source_ids also the list of image/source_id of every record """
+
+
+def scan_record(record_path, source_ids=True):
+    compression = detect_compression(record_path)
+    if compression is not None:
+        raise ValueError("{} is {} compressed, records in a compressed stream have no "
+                         "byte offsets to index".format(record_path, compression))
+    entries = []
+    ids = []
+    size = os.path.getsize(record_path)
+    with open(record_path, "rb") as f:
+        offset = 0
+        while offset < size:
+            header = f.read(HEADER_SIZE)
+            if len(header) < HEADER_SIZE:
+                raise CorruptRecordError("truncated record header in {}".format(record_path))
+            (length,) = LENGTH.unpack(header[:LENGTH.size])
+            if offset + HEADER_SIZE + length + CRC.size > size:
+                raise CorruptRecordError("truncated record in {}".format(record_path))
+            entries.append((offset + HEADER_SIZE, length))
+            if source_ids:
+                ids.append(source_id(f.read(length)))
+                f.seek(CRC.size, os.SEEK_CUR)
+            else:
+                f.seek(length + CRC.size, os.SEEK_CUR)
+            offset += HEADER_SIZE + length + CRC.size
+    return np.array(entries, dtype=np.int64).reshape(-1, 2), ids
+
+
+def record_stamp(record_path):
+    st = os.stat(record_path)
+    return st.st_size, st.st_mtime_ns
+
+
+def index_record(record_path, source_ids=True):
+    stamp = record_stamp(record_path)
+    entries, ids = scan_record(record_path, source_ids)
+    np.save(index_path(record_path), np.vstack([np.array([stamp], dtype=np.int64), entries]))
+    if source_ids:
+        np.save(ids_path(record_path), np.array(ids, dtype=np.str_))
+    elif os.path.exists(ids_path(record_path)):
+        # ids of an older version of the file
+        os.remove(ids_path(record_path))
+    return len(entries)
+
+
+""" the (n, 2) entries of the sidecar, reindexing when it is missing or
+    was built from another version of the record file """
+
+
+def load_index(record_path):
+    if os.path.exists(index_path(record_path)):
+        sidecar = np.load(index_path(record_path), mmap_mode="r")
+        if len(sidecar) and tuple(int(v) for v in sidecar[0]) == record_stamp(record_path):
+            return sidecar[1:]
+    index_record(record_path)
+    return np.load(index_path(record_path), mmap_mode="r")[1:]
+
+
+class RecordIndex():
+    def __init__(self, record_path, verify=False):
+        self.record_path = record_path
+        self.verify = verify
+        self.entries = load_index(record_path)
+        self.ids = None
+        self.id_lookup = None
+        self.mm = None
+        # mmap refuses empty files, an empty shard just has no records
+        if len(self.entries):
+            with open(record_path, "rb") as f:
+                self.mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        pass
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __getitem__(self, i):
+        offset, length = (int(v) for v in self.entries[i])
+        record = self.mm[offset:offset + length]
+        if self.verify:
+            (crc,) = CRC.unpack_from(self.mm, offset + length)
+            if crc != masked_crc32c(record):
+                raise CorruptRecordError("bad data crc for record {} in {}".format(
+                    i, self.record_path))
+        return record
+
+    def example(self, i):
+        example = example_proto.Example()
+        example.ParseFromString(self[i])
+        return example
+
+    def find(self, source_id):
+        if self.id_lookup is None:
+            if not os.path.exists(ids_path(self.record_path)):
+                index_record(self.record_path)
+            self.ids = np.load(ids_path(self.record_path))
+            self.id_lookup = {str(sid): i for i, sid in enumerate(self.ids)}
+        return self.id_lookup.get(source_id)
+
+    def by_source_id(self, source_id):
+        i = self.find(source_id)
+        if i is None:
+            raise KeyError(source_id)
+        return self[i]
+
+    """ every nth record, like sample_1_of_n_eval_examples """
+
+    def sample_1_of_n(self, n):
+        for i in range(0, len(self), n):
+            yield self[i]
+
+    def close(self):
+        if self.mm is not None:
+            self.mm.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    sub = parser.add_subparsers(dest="command")
+    index_cmd = sub.add_parser("index")
+    index_cmd.add_argument("paths", nargs="+")
+    index_cmd.add_argument("--no-ids", action="store_true",
+                           help="only offsets, skips parsing the records")
+    show_cmd = sub.add_parser("show")
+    show_cmd.add_argument("path")
+    show_cmd.add_argument("record", help="record number or image/source_id")
+    args = parser.parse_args()
+
+    if args.command == "index":
+        for path in args.paths:
+            try:
+                print("Indexed %d records in %s" % (index_record(path, not args.no_ids), path))
+            except ValueError as e:
+                print("Skipped %s" % e)
+    elif args.command == "show":
+        index = RecordIndex(args.path, verify=True)
+        i = int(args.record) if args.record.isdigit() else index.find(args.record)
+        if i is None:
+            raise SystemExit("no record with source id {}".format(args.record))
+        example = index.example(i)
+        for key in sorted(example.features.feature):
+            if key != "image/encoded":
+                print(key, example.features.feature[key])
+    else:
+        parser.print_help()
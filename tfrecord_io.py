@@ -0,0 +1,253 @@
+""" 
+    TFRecord files without TensorFlow
+
+    Each record is framed as
+        uint64 length, uint32 masked crc32c of length, data, uint32 masked crc32c of data
+    all little endian. With GZIP or ZLIB compression the whole framed stream
+    is compressed, as TensorFlow does. crc32c is table driven, long buffers are cut into
+    fixed size blocks whose crcs are computed side by side with numpy and
+    folded together. The crc32c package is used instead when installed
+
+    python tfrecord_io.py verify some.record
+    reads a record file written by tf.python_io.TFRecordWriter, checks every
+    crc and rewrites it in memory, the bytes must come out identical
+ """
+
+import argparse
+import struct
+import sys
+import zlib
+
+import numpy as np
+
+try:
+    import crc32c as crc32c_ext
+except ImportError:
+    crc32c_ext = None
+
+CRC32C_POLY = 0x82F63B78
+MASK_DELTA = 0xA282EAD8
+# buffers at least this long go through the numpy block path
+BLOCK_SIZE = 256
+NUMPY_MIN_BYTES = 4 * BLOCK_SIZE
+
+LENGTH = struct.Struct("<Q")
+CRC = struct.Struct("<I")
+
+# window bits TensorFlow uses for its compression types
+COMPRESSION_WBITS = {"GZIP": 16 + zlib.MAX_WBITS, "ZLIB": zlib.MAX_WBITS}
+READ_CHUNK = 1 << 16
+DECOMPRESS_CHUNK = 1 << 20
+
+
+def make_table():
+    table = np.arange(256, dtype=np.uint32)
+    for _ in range(8):
+        table = np.where(table & 1, (table >> 1) ^ CRC32C_POLY, table >> 1).astype(np.uint32)
+    return table
+
+
+CRC_TABLE_NP = make_table()
+CRC_TABLE = CRC_TABLE_NP.tolist()
+
+
+""" tables for the linear operator that advances a crc state over
+    BLOCK_SIZE zero bytes, one table per byte of the state """
+
+
+def make_shift_tables():
+    states = np.zeros(4 * 256, dtype=np.uint32)
+    for k in range(4):
+        states[k * 256:(k + 1) * 256] = np.arange(256, dtype=np.uint32) << (8 * k)
+    for _ in range(BLOCK_SIZE):
+        states = CRC_TABLE_NP[states & 0xFF] ^ (states >> 8)
+    return [states[k * 256:(k + 1) * 256].tolist() for k in range(4)]
+
+
+SHIFT_TABLES = make_shift_tables()
+
+
+def crc_update_small(crc, data):
+    table = CRC_TABLE
+    for byte in data:
+        crc = table[(crc ^ byte) & 0xFF] ^ (crc >> 8)
+    return crc
+
+
+def crc_update_blocks(crc, data):
+    num_blocks = len(data) // BLOCK_SIZE
+    blocks = np.frombuffer(data, dtype=np.uint8, count=num_blocks * BLOCK_SIZE)
+    blocks = blocks.reshape(num_blocks, BLOCK_SIZE).astype(np.uint32)
+    # the incoming state belongs to the first block only, crc is linear
+    states = np.zeros(num_blocks, dtype=np.uint32)
+    states[0] = crc
+    for i in range(BLOCK_SIZE):
+        states = CRC_TABLE_NP[(states ^ blocks[:, i]) & 0xFF] ^ (states >> 8)
+
+    t0, t1, t2, t3 = SHIFT_TABLES
+    crc = 0
+    for state in states.tolist():
+        crc = (t0[crc & 0xFF] ^ t1[(crc >> 8) & 0xFF] ^
+               t2[(crc >> 16) & 0xFF] ^ t3[crc >> 24]) ^ state
+    return crc_update_small(crc, memoryview(data)[num_blocks * BLOCK_SIZE:])
+
+
+def crc32c(data):
+    if crc32c_ext is not None:
+        return crc32c_ext.crc32c(data)
+    if len(data) >= NUMPY_MIN_BYTES:
+        crc = crc_update_blocks(0xFFFFFFFF, data)
+    else:
+        crc = crc_update_small(0xFFFFFFFF, data)
+    return crc ^ 0xFFFFFFFF
+
+
+def masked_crc32c(data):
+    crc = crc32c(data)
+    return (((crc >> 15) | (crc << 17)) + MASK_DELTA) & 0xFFFFFFFF
+
+
+class CorruptRecordError(IOError):
+    pass
+
+
+""" None, "" and "NONE" mean uncompressed, otherwise GZIP or ZLIB """
+
+
+def compression_type(compression):
+    if compression is None or compression.upper() in ("", "NONE"):
+        return None
+    if compression.upper() not in COMPRESSION_WBITS:
+        raise ValueError("compression must be NONE, GZIP or ZLIB, got {}".format(compression))
+    return compression.upper()
+
+
+""" file-like read() over a zlib or gzip stream. Reads advance an offset
+    into the decompressed buffer, the consumed front is only dropped when
+    the buffer is refilled, and each refill inflates at most
+    DECOMPRESS_CHUNK bytes so compressible data can't balloon it.
+    A damaged or truncated stream raises CorruptRecordError like bad
+    framing does """
+
+
+class DecompressingReader():
+    def __init__(self, f, compression):
+        self.f = f
+        self.decompressor = zlib.decompressobj(COMPRESSION_WBITS[compression])
+        self.buffer = bytearray()
+        self.offset = 0
+        pass
+
+    def read(self, size):
+        while len(self.buffer) - self.offset < size and not self.decompressor.eof:
+            data = self.decompressor.unconsumed_tail or self.f.read(READ_CHUNK)
+            if not data:
+                raise CorruptRecordError("truncated compressed stream in {}".format(
+                    getattr(self.f, "name", "stream")))
+            del self.buffer[:self.offset]
+            self.offset = 0
+            try:
+                self.buffer += self.decompressor.decompress(data, DECOMPRESS_CHUNK)
+            except zlib.error as e:
+                raise CorruptRecordError("corrupt compressed stream in {}: {}".format(
+                    getattr(self.f, "name", "stream"), e))
+        data = bytes(self.buffer[self.offset:self.offset + size])
+        self.offset += len(data)
+        return data
+
+
+def frame(data):
+    length = LENGTH.pack(len(data))
+    return b"".join([length, CRC.pack(masked_crc32c(length)), data,
+                     CRC.pack(masked_crc32c(data))])
+
+
+""" drop in for tf.python_io.TFRecordWriter, compression is None,
+    GZIP or ZLIB like tf.python_io.TFRecordCompressionType """
+
+
+class TFRecordWriter():
+    def __init__(self, path, compression=None, level=zlib.Z_DEFAULT_COMPRESSION):
+        self.f = open(path, "wb")
+        self.compression = compression_type(compression)
+        self.compressor = None
+        if self.compression is not None:
+            self.compressor = zlib.compressobj(level, zlib.DEFLATED,
+                                               COMPRESSION_WBITS[self.compression])
+        pass
+
+    def write(self, record):
+        data = frame(record)
+        if self.compressor is not None:
+            data = self.compressor.compress(data)
+        self.f.write(data)
+
+    def flush(self):
+        if self.compressor is not None:
+            self.f.write(self.compressor.flush(zlib.Z_SYNC_FLUSH))
+        self.f.flush()
+
+    def close(self):
+        if self.compressor is not None:
+            self.f.write(self.compressor.flush())
+            self.compressor = None
+        self.f.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+""" yields the records of a file, checking both crcs of each one unless
+    verify is False. Raises CorruptRecordError on a bad crc or truncation """
+
+
+def tf_record_iterator(path, verify=True, compression=None):
+    compression = compression_type(compression)
+    with open(path, "rb") as raw:
+        f = raw if compression is None else DecompressingReader(raw, compression)
+        while True:
+            header = f.read(LENGTH.size + CRC.size)
+            if not header:
+                return
+            if len(header) < LENGTH.size + CRC.size:
+                raise CorruptRecordError("truncated record header in {}".format(path))
+            length_bytes = header[:LENGTH.size]
+            (length,) = LENGTH.unpack(length_bytes)
+            if verify and CRC.unpack(header[LENGTH.size:])[0] != masked_crc32c(length_bytes):
+                raise CorruptRecordError("bad length crc in {}".format(path))
+            data = f.read(length)
+            footer = f.read(CRC.size)
+            if len(data) < length or len(footer) < CRC.size:
+                raise CorruptRecordError("truncated record in {}".format(path))
+            if verify and CRC.unpack(footer)[0] != masked_crc32c(data):
+                raise CorruptRecordError("bad data crc in {}".format(path))
+            yield data
+
+
+def verify_against(path, compression=None):
+    compression = compression_type(compression)
+    with open(path, "rb") as f:
+        original = f.read()
+    if compression is not None:
+        # compressed bytes depend on the zlib build, compare the framing
+        original = zlib.decompress(original, COMPRESSION_WBITS[compression])
+    rewritten = b"".join(frame(record) for record in tf_record_iterator(path, True, compression))
+    return original == rewritten
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("command", choices=("verify",))
+    parser.add_argument("paths", nargs="+")
+    parser.add_argument("--compression", default=None, help="NONE, GZIP or ZLIB")
+    args = parser.parse_args()
+
+    ok = True
+    for path in args.paths:
+        same = verify_against(path, args.compression)
+        ok = ok and same
+        print("{} {}".format("OK  " if same else "DIFF", path))
+    sys.exit(0 if ok else 1)
@@ -0,0 +1,184 @@
+""" 
+    Validation pass over an annotation set
+
+    Image sizes are probed from the JPEG headers only, in parallel, and
+    cached per image by size and mtime so later runs only probe changed
+    files. Box checks (out of bounds, zero area, duplicates, size mismatch
+    with the image) run vectorized over the whole AnnotationStore
+
+    python validate_dataset.py final_train --image-root . ./all_drive
+ """
+
+import argparse
+import json
+import multiprocessing
+import os
+import struct
+
+import numpy as np
+from PIL import Image
+
+from annotation_store import AnnotationStore
+from path_resolver import PathResolver
+
+# no .json suffix, json_dir is read as annotations
+CACHE_NAME = ".validate_cache"
+
+# start of frame markers carry the frame size, DHT/JPG/DAC share the range
+JPEG_SOF_MARKERS = set(range(0xC0, 0xD0)) - {0xC4, 0xC8, 0xCC}
+
+
+""" reads (width, height) from the SOF segment of a JPEG without
+    decoding it, other formats go through PIL which also only reads
+    the header on open """
+
+
+def probe_image_size(path):
+    with open(path, "rb") as f:
+        if f.read(2) != b"\xff\xd8":
+            with Image.open(path) as img:
+                return img.size
+        while True:
+            byte = f.read(1)
+            while byte and byte != b"\xff":
+                byte = f.read(1)
+            while byte == b"\xff":
+                byte = f.read(1)
+            if not byte:
+                raise ValueError("no frame header in {}".format(path))
+            marker = byte[0]
+            if marker == 0x01 or 0xD0 <= marker <= 0xD9:
+                # markers without a length field
+                continue
+            length = struct.unpack(">H", f.read(2))[0]
+            if marker in JPEG_SOF_MARKERS:
+                _, height, width = struct.unpack(">BHH", f.read(5))
+                return width, height
+            f.seek(length - 2, os.SEEK_CUR)
+
+
+def probe_entry(path):
+    try:
+        st = os.stat(path)
+        width, height = probe_image_size(path)
+        return path, [st.st_size, st.st_mtime_ns, width, height, None]
+    except (IOError, OSError, ValueError, struct.error) as e:
+        return path, [None, None, 0, 0, "unreadable image {}: {}".format(type(e).__name__, e)]
+
+
+""" probes every image, reusing cache entries whose size and mtime still
+    match, returns (widths, heights, errors) aligned with paths """
+
+
+def probe_sizes(paths, cache, workers=None, chunksize=64):
+    stale = []
+    for path in set(paths):
+        if path is None:
+            continue
+        entry = cache.get(path)
+        try:
+            st = os.stat(path)
+        except OSError:
+            stale.append(path)
+            continue
+        if entry is None or entry[0] != st.st_size or entry[1] != st.st_mtime_ns:
+            stale.append(path)
+
+    if workers == 1 or len(stale) < chunksize:
+        results = map(probe_entry, stale)
+        for path, entry in results:
+            cache[path] = entry
+    else:
+        with multiprocessing.Pool(workers) as pool:
+            for path, entry in pool.imap_unordered(probe_entry, stale, chunksize):
+                cache[path] = entry
+
+    missing = [None, None, 0, 0, "image not found"]
+    entries = [cache[path] if path is not None else missing for path in paths]
+    widths = np.array([entry[2] for entry in entries], dtype=np.int32)
+    heights = np.array([entry[3] for entry in entries], dtype=np.int32)
+    errors = [entry[4] for entry in entries]
+    return widths, heights, errors, len(stale)
+
+
+""" returns {file path: [issues]} for every file with a problem """
+
+
+def validate(store, resolver, cache=None, workers=None):
+    cache = {} if cache is None else cache
+    paths = resolver.resolve_many([str(path) for path in store.paths])
+    widths, heights, errors, probed = probe_sizes(paths, cache, workers)
+
+    issues = {}
+
+    def flag(file_indices, message):
+        for i in file_indices:
+            issues.setdefault(str(store.paths[i]), []).append(message)
+
+    for i, error in enumerate(errors):
+        if error is not None:
+            flag([i], error)
+    ok = np.array([error is None for error in errors], dtype=bool)
+    mismatch = ok & ((widths != store.files["width"]) | (heights != store.files["height"]))
+    flag(np.flatnonzero(mismatch), "image size does not match annotation")
+
+    boxes = store.boxes
+    file_index = boxes["file_index"]
+    # bounds are checked against the real image when it could be probed
+    frame_w = np.where(ok, widths, store.files["width"])[file_index]
+    frame_h = np.where(ok, heights, store.files["height"])[file_index]
+    right = boxes["left"] + boxes["width"]
+    bottom = boxes["top"] + boxes["height"]
+    out_of_bounds = (boxes["left"] < 0) | (boxes["top"] < 0) | \
+        (right > frame_w) | (bottom > frame_h)
+    zero_area = (boxes["width"] <= 0) | (boxes["height"] <= 0)
+    flag(file_index[out_of_bounds], "box out of bounds")
+    flag(file_index[zero_area], "zero area box")
+
+    rows = np.stack([boxes[name] for name in
+                     ("file_index", "class_id", "left", "top", "width", "height")], axis=1)
+    if len(rows):
+        order = np.lexsort(rows.T[::-1])
+        sorted_rows = rows[order]
+        dup = np.flatnonzero((sorted_rows[1:] == sorted_rows[:-1]).all(axis=1))
+        flag(np.unique(sorted_rows[dup, 0]), "duplicate box")
+    return issues, probed
+
+
+def load_cache(path):
+    try:
+        with open(path, "r") as f:
+            return json.load(f)
+    except (IOError, OSError, ValueError):
+        return {}
+
+
+def save_cache(path, cache):
+    with open(path + ".tmp", "w") as f:
+        json.dump(cache, f, separators=(",", ":"))
+    os.replace(path + ".tmp", path)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("json_dir", help="json annotation dir, or a saved AnnotationStore dir")
+    parser.add_argument("--image-root", nargs="*", default=None,
+                        help="image roots, defaults to path_resolver.default_roots()")
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--cache", default=None,
+                        help="probe cache file, defaults to {} in json_dir".format(CACHE_NAME))
+    args = parser.parse_args()
+
+    if os.path.exists(os.path.join(args.json_dir, "paths.npy")):
+        store = AnnotationStore.load(args.json_dir)
+    else:
+        store = AnnotationStore.from_json_dir(args.json_dir)
+    cache_path = args.cache or os.path.join(args.json_dir, CACHE_NAME)
+    cache = load_cache(cache_path)
+    issues, probed = validate(store, PathResolver(args.image_root), cache, args.workers)
+    save_cache(cache_path, cache)
+
+    for path in sorted(issues):
+        print(path, "; ".join(sorted(set(issues[path]))))
+    print("Checked %d files, %d boxes, probed %d images, %d files with issues" %
+          (len(store), store.num_boxes, probed, len(issues)))
@@ -0,0 +1,185 @@
+"""
+    Integrity check of record shards before a training launch
+
+    Every shard is read by its own worker: the CRC framing of all records
+    is checked, boxes must be normalized and ordered, labels and their
+    text must match the label map, and an evenly spaced fraction of the
+    embedded JPEGs is decoded and compared with image/width and height.
+    Prints one line per shard and exits non zero when any shard fails
+
+    python verify_records.py records/nabla_robot_plates_*.record-* --decode-fraction 0.1
+ """
+
+import argparse
+import glob
+import io
+import multiprocessing
+import os
+import re
+import sys
+import time
+
+import numpy as np
+from PIL import Image
+
+import example_proto
+from tfrecord_io import CorruptRecordError, tf_record_iterator
+
+LABEL_MAP_PATH = "robot_plate_label_map.pbtxt"
+RECORD_GLOB = os.path.join(".", "records", "*.record-?????-of-?????")
+DECODE_FRACTION = 0.05
+# issues listed per shard, the count is always reported
+MAX_ISSUES = 10
+
+LABEL_MAP_ITEM = re.compile(r"item\s*\{(.*?)\}", re.S)
+LABEL_MAP_ID = re.compile(r"\bid\s*:\s*(\d+)")
+LABEL_MAP_NAME = re.compile(r"\bname\s*:\s*['\"]([^'\"]*)['\"]")
+
+BOX_KEYS = ("image/object/bbox/xmin", "image/object/bbox/ymin",
+            "image/object/bbox/xmax", "image/object/bbox/ymax")
+
+
+""" {id: name} of a label map pbtxt, only the id and name fields of
+    each item are read """
+
+
+def load_label_map(path=LABEL_MAP_PATH):
+    with open(path, "r") as f:
+        text = f.read()
+    label_map = {}
+    for item in LABEL_MAP_ITEM.findall(text):
+        cid = LABEL_MAP_ID.search(item)
+        name = LABEL_MAP_NAME.search(item)
+        if cid is None or name is None:
+            raise ValueError("label map item without id or name in {}".format(path))
+        label_map[int(cid.group(1))] = name.group(1).encode("utf8")
+    return label_map
+
+
+""" issues of one parsed Example, the image is decoded when decode is set """
+
+
+def check_example(example, label_map, decode):
+    feature = example.features.feature
+    issues = []
+    boxes = [feature[key].float_list.value for key in BOX_KEYS]
+    labels = list(feature["image/object/class/label"].int64_list.value)
+    texts = list(feature["image/object/class/text"].bytes_list.value)
+    counts = set(len(values) for values in boxes) | {len(labels), len(texts)}
+    if len(counts) != 1:
+        return ["object fields have different lengths"]
+
+    boxes = np.array(boxes, dtype=np.float32).reshape(4, -1)
+    if not np.isfinite(boxes).all() or (boxes < 0).any() or (boxes > 1).any():
+        issues.append("box outside [0, 1]")
+    if (boxes[0] > boxes[2]).any() or (boxes[1] > boxes[3]).any():
+        issues.append("box min above max")
+    for label, text in zip(labels, texts):
+        if label not in label_map:
+            issues.append("label {} not in label map".format(label))
+        elif label_map[label] != text:
+            issues.append("label {} is {}, text says {}".format(
+                label, label_map[label].decode("utf8"), text.decode("utf8", "replace")))
+
+    if decode:
+        encoded = feature["image/encoded"].bytes_list.value
+        width = feature["image/width"].int64_list.value
+        height = feature["image/height"].int64_list.value
+        try:
+            with Image.open(io.BytesIO(encoded[0] if encoded else b"")) as img:
+                img.load()
+                size = img.size
+        except (IOError, OSError, ValueError) as e:
+            issues.append("undecodable image {}: {}".format(type(e).__name__, e))
+        else:
+            if list(size) != list(width) + list(height):
+                issues.append("image is {}x{}, record says {}x{}".format(
+                    size[0], size[1], list(width), list(height)))
+    return issues
+
+
+""" worker task, (shard path, decode fraction, label map, compression).
+    Records are decoded when the running count of decode_fraction * n
+    steps up, which spreads them evenly through the shard """
+
+
+def verify_shard(task):
+    path, decode_fraction, label_map, compression = task
+    start = time.perf_counter()
+    report = {"path": path, "records": 0, "decoded": 0, "issues": 0, "messages": []}
+
+    def flag(index, message):
+        report["issues"] += 1
+        if len(report["messages"]) < MAX_ISSUES:
+            report["messages"].append("record {}: {}".format(index, message))
+
+    example = example_proto.Example()
+    try:
+        for index, record in enumerate(tf_record_iterator(path, True, compression)):
+            decode = int((index + 1) * decode_fraction) > int(index * decode_fraction)
+            try:
+                example.ParseFromString(record)
+            except Exception as e:
+                # protobuf's DecodeError differs between runtimes
+                flag(index, "unparsable Example {}".format(type(e).__name__))
+                continue
+            for message in check_example(example, label_map, decode):
+                flag(index, message)
+            report["records"] += 1
+            report["decoded"] += decode
+        pass
+    except (CorruptRecordError, IOError, OSError) as e:
+        # framing is lost, nothing after this point can be read
+        flag(report["records"], str(e))
+
+    report["bytes"] = os.path.getsize(path) if os.path.exists(path) else 0
+    report["seconds"] = time.perf_counter() - start
+    return report
+
+
+""" verifies every shard in parallel, reports come back in path order """
+
+
+def verify_records(paths, decode_fraction=DECODE_FRACTION, label_map=None,
+                   compression=None, workers=None):
+    label_map = label_map if label_map is not None else load_label_map()
+    tasks = [(path, decode_fraction, label_map, compression) for path in paths]
+    if workers == 1 or len(tasks) <= 1:
+        return list(map(verify_shard, tasks))
+    with multiprocessing.Pool(min(workers or len(tasks), len(tasks))) as pool:
+        return pool.map(verify_shard, tasks, chunksize=1)
+
+
+def print_report(report):
+    print("%s %s  %d records, %d decoded, %.1f MB in %.2fs" % (
+        "FAIL" if report["issues"] else "OK  ", report["path"], report["records"],
+        report["decoded"], report["bytes"] / 2.0**20, report["seconds"]))
+    for message in report["messages"]:
+        print("     " + message)
+    if report["issues"] > len(report["messages"]):
+        print("     ... {} more".format(report["issues"] - len(report["messages"])))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("paths", nargs="*", help="record shards, defaults to " + RECORD_GLOB)
+    parser.add_argument("--decode-fraction", type=float, default=DECODE_FRACTION,
+                        help="fraction of the images to decode, 0 skips decoding")
+    parser.add_argument("--label-map", default=LABEL_MAP_PATH)
+    parser.add_argument("--compression", default=None, help="NONE, GZIP or ZLIB")
+    parser.add_argument("--workers", type=int, default=None)
+    args = parser.parse_args()
+
+    paths = sorted(args.paths or glob.glob(RECORD_GLOB))
+    if not paths:
+        sys.exit("no record files found")
+    start = time.perf_counter()
+    reports = verify_records(paths, args.decode_fraction, load_label_map(args.label_map),
+                             args.compression, args.workers)
+    for report in reports:
+        print_report(report)
+    failed = sum(1 for report in reports if report["issues"])
+    print("Checked %d shards, %d records in %.2fs, %d shards with issues" % (
+        len(reports), sum(report["records"] for report in reports),
+        time.perf_counter() - start, failed))
+    sys.exit(1 if failed else 0)